@@ -8,8 +8,11 @@ for multiple APIs.
 Author: Marcus Burghardt - https://github.com/marcusburghardt
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import configparser
+import fcntl
+import hashlib
+import json
 import os
 import sys
 import yaml
@@ -17,6 +20,9 @@ import yaml
 root_path = os.path.dirname(os.path.realpath(__file__))
 CONF_FILE = f"{root_path}/apis.yml"
 
+# Parsed yml files, reloaded only when the file is modified.
+yml_cache = {}
+
 
 def create_canonical_name(raw_string):
     canonical_name = raw_string.replace('/', '_')
@@ -48,6 +54,25 @@ def get_github_token():
     return get_parameter_value(github_creds_file, "DEFAULT", "github_token")
 
 
+def get_github_tokens() -> list:
+    # The creds file accepts a pool of comma separated tokens in "github_tokens" besides the
+    # single "github_token". Both can be used together.
+    github_creds_file = get_parameter_value(CONF_FILE, 'github', 'creds_file')
+    tokens = []
+    tokens_string = get_optional_parameter_value(github_creds_file, 'DEFAULT', 'github_tokens')
+    if tokens_string:
+        tokens.extend(token.strip() for token in create_list_from_string(tokens_string, ','))
+    token = get_optional_parameter_value(github_creds_file, 'DEFAULT', 'github_token')
+    if token:
+        tokens.append(token.strip())
+    return list(dict.fromkeys(token for token in tokens if token))
+
+
+def get_export_dir():
+    return get_optional_parameter_value(CONF_FILE, 'github', 'export_dir',
+                                        f'{root_path}/export')
+
+
 def get_github_labels():
     try:
         labels = get_parameter_value(CONF_FILE, 'github', 'labels')
@@ -70,10 +95,19 @@ def get_github_metrics(context):
         return metrics['no_activity_limit']
     elif context == 'workflows':
         return metrics['workflows']
+    elif context == 'adaptive_max_age':
+        return metrics.get('adaptive_max_age', 360)
+    elif context == 'team_ttl':
+        return metrics.get('team_ttl', 1440)
     else:
         return None
 
 
+def get_github_plan() -> dict:
+    plan = get_optional_parameter_value(CONF_FILE, 'github', 'plan', {}) or {}
+    return {'orgs': plan.get('orgs') or [], 'repos': plan.get('repos') or []}
+
+
 def get_delta_time(start_date, end_date, unit):
     delta_time = end_date - start_date
     seconds = (delta_time.days*86400) + delta_time.seconds
@@ -92,6 +126,20 @@ def get_old_date(days):
     return now - timedelta(days=days)
 
 
+def get_utc_timestamp(date: datetime) -> float:
+    # Dates without timezone returned by Github are in UTC.
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def get_optional_parameter_value(config_file, section, parameter, default=None):
+    try:
+        return get_parameter_value(config_file, section, parameter)
+    except KeyError:
+        return default
+
+
 def get_parameter_from_ini(config_file, section, parameter):
     config = configparser.ConfigParser()
     config.read(config_file)
@@ -99,13 +147,23 @@ def get_parameter_from_ini(config_file, section, parameter):
 
 
 def get_parameter_from_yml(config_file, section, parameter):
+    yml_content = load_yml_file(config_file)
+    return yml_content[section][parameter]
+
+
+def load_yml_file(config_file):
+    modified_time = os.path.getmtime(config_file)
+    cached = yml_cache.get(config_file)
+    if cached and cached[0] == modified_time:
+        return cached[1]
     with open(config_file, 'r') as yml_file:
         try:
             yml_content = yaml.safe_load(yml_file)
-            return yml_content[section][parameter]
         except yaml.YAMLError as exc:
             print(exc)
             sys.exit(1)
+    yml_cache[config_file] = (modified_time, yml_content)
+    return yml_content
 
 
 def get_parameter_value(config_file, section, parameter):
@@ -115,6 +173,48 @@ def get_parameter_value(config_file, section, parameter):
         return get_parameter_from_ini(config_file, section, parameter)
 
 
+def get_shard_index(item_id: str, shards: int) -> int:
+    # A stable digest is used instead of hash(), which is salted per process, so every
+    # worker assigns the same items to the same shard on every run and on every host.
+    digest = hashlib.sha1(item_id.encode('utf-8')).hexdigest()
+    return int(digest, 16) % shards + 1
+
+
+def get_state_file(name: str) -> str:
+    # Files used to keep information between runs.
+    state_dir = get_optional_parameter_value(CONF_FILE, 'github', 'state_dir',
+                                             f'{root_path}/state')
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, name)
+
+
+def lock_state(name: str):
+    # The lock is released when the returned file is closed or the process ends.
+    lock_file = open(get_state_file(name), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print(f'Another run is holding the {name} lock.')
+        sys.exit(1)
+    return lock_file
+
+
+def load_state(name: str) -> dict:
+    state_file = get_state_file(name)
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as json_file:
+        return json.load(json_file)
+
+
+def save_state(name: str, state: dict) -> None:
+    # The file is replaced atomically, so an interrupted run never corrupts the last state.
+    state_file = get_state_file(name)
+    with open(f'{state_file}.tmp', 'w') as json_file:
+        json.dump(state, json_file, default=str)
+    os.replace(f'{state_file}.tmp', state_file)
+
+
 def parse_filters_string(filters_dict, object_type=''):
     if object_type == 'issue':
         filters = {'state': 'open', 'assignee': 'none', 'milestone': 'none',
@@ -130,6 +230,18 @@ def parse_filters_string(filters_dict, object_type=''):
     return filters
 
 
+def parse_shard_string(shard_string: str) -> tuple:
+    try:
+        index, shards = [int(value) for value in shard_string.split('/')]
+    except ValueError:
+        print('Invalid shard. Use the "i/N" format, e.g.: 1/4')
+        sys.exit(1)
+    if shards < 1 or index < 1 or index > shards:
+        print(f'Invalid shard {shard_string}. The index must be between 1 and {shards}')
+        sys.exit(1)
+    return index, shards
+
+
 def print_object_info_header(object_type):
     if object_type == 'event':
         print('actor,eventType,createdAt')
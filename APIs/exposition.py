@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Script created to parse metrics in the Prometheus text exposition format,
+family by family, and to compare snapshots or report their cardinality
+without loading them in Prometheus.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://prometheus.io/docs/instrumenting/exposition_formats/
+
+from argparse import ArgumentParser
+import math
+import sys
+
+LABEL_ESCAPES = {'\\': '\\', '"': '"', 'n': '\n'}
+
+
+def parse_labels_string(labels_string: str) -> tuple:
+    labels = []
+    position = 0
+    while position < len(labels_string):
+        equal = labels_string.index('=', position)
+        name = labels_string[position:equal].strip().lstrip(',').strip()
+        position = labels_string.index('"', equal) + 1
+        value = []
+        while labels_string[position] != '"':
+            if labels_string[position] == '\\':
+                position += 1
+                value.append(LABEL_ESCAPES.get(labels_string[position],
+                                               '\\' + labels_string[position]))
+            else:
+                value.append(labels_string[position])
+            position += 1
+        labels.append((name, ''.join(value)))
+        position += 1
+        while position < len(labels_string) and labels_string[position] in ', ':
+            position += 1
+    return tuple(sorted(labels))
+
+
+def parse_sample_line(line: str) -> tuple:
+    if '{' in line:
+        name, rest = line.split('{', 1)
+        labels_string, rest = rest.rsplit('}', 1)
+        labels = parse_labels_string(labels_string)
+    else:
+        name, rest = line.split(None, 1)
+        labels = ()
+    value = float(rest.split()[0])
+    return name.strip(), labels, value
+
+
+def get_sample_family(sample_name: str, family: dict) -> bool:
+    if family is None:
+        return False
+    if sample_name == family['name']:
+        return True
+    suffixes = ['_total', '_created', '_bucket', '_count', '_sum', '_info']
+    return any(sample_name == f"{family['name']}{suffix}" for suffix in suffixes)
+
+
+def create_family(name: str) -> dict:
+    return {'name': name, 'help': '', 'type': 'untyped', 'samples': []}
+
+
+def parse_exposition_families(lines):
+    # Only one family is kept in memory at a time, since the exposition format requires all
+    # the lines of a family to be grouped together.
+    family = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            fields = line.split(None, 3)
+            if len(fields) < 3 or fields[1] not in ['HELP', 'TYPE']:
+                continue
+            if family is None or family['name'] != fields[2]:
+                if family is not None:
+                    yield family
+                family = create_family(fields[2])
+            if fields[1] == 'HELP':
+                family['help'] = fields[3] if len(fields) > 3 else ''
+            else:
+                family['type'] = fields[3] if len(fields) > 3 else 'untyped'
+            continue
+        sample = parse_sample_line(line)
+        if not get_sample_family(sample[0], family):
+            if family is not None:
+                yield family
+            family = create_family(sample[0])
+        family['samples'].append(sample)
+    if family is not None:
+        yield family
+
+
+def get_line_name(line: str) -> str:
+    if not line:
+        return None
+    if line.startswith('#'):
+        fields = line.split(None, 3)
+        if len(fields) < 3 or fields[1] not in ['HELP', 'TYPE']:
+            return None
+        return fields[2]
+    return line.split('{', 1)[0].split(None, 1)[0]
+
+
+def index_exposition_file(snapshot_file: str) -> dict:
+    # Maps each family to its byte range in the file, so a single family can be loaded later.
+    index = {}
+    current_name = None
+    start = 0
+    with open(snapshot_file, 'rb') as metrics_file:
+        while True:
+            position = metrics_file.tell()
+            line = metrics_file.readline()
+            if not line:
+                break
+            line = line.decode('utf-8').strip()
+            name = get_line_name(line)
+            if name is None:
+                continue
+            # Like the parser, a HELP or TYPE line with another name always starts a family.
+            # The suffixes only group the sample lines.
+            if current_name is not None and (name == current_name or (
+                    not line.startswith('#') and
+                    get_sample_family(name, {'name': current_name}))):
+                continue
+            if current_name is not None:
+                index[current_name] = (start, position - start)
+            current_name = name
+            start = position
+        if current_name is not None:
+            index[current_name] = (start, position - start)
+    return index
+
+
+def read_exposition_family(snapshot_file: str, offset: int, length: int) -> dict:
+    with open(snapshot_file, 'rb') as metrics_file:
+        metrics_file.seek(offset)
+        lines = metrics_file.read(length).splitlines()
+    for family in parse_exposition_families(lines):
+        return family
+
+
+def get_family_series(family: dict) -> dict:
+    return {(name, labels): value for name, labels, value in family['samples']}
+
+
+def is_value_changed(old_value: float, new_value: float, tolerance: float) -> bool:
+    if math.isnan(old_value) and math.isnan(new_value):
+        return False
+    return abs(new_value - old_value) > tolerance
+
+
+def diff_exposition_files(old_file: str, new_file: str, tolerance=0.0):
+    old_index = index_exposition_file(old_file)
+    seen_families = set()
+    with open(new_file, 'rb') as metrics_file:
+        for new_family in parse_exposition_families(metrics_file):
+            name = new_family['name']
+            seen_families.add(name)
+            new_series = get_family_series(new_family)
+            old_series = {}
+            if name in old_index:
+                old_series = get_family_series(read_exposition_family(old_file,
+                                                                      *old_index[name]))
+            for series, value in new_series.items():
+                if series not in old_series:
+                    yield ('added', name, series, None, value)
+                elif is_value_changed(old_series[series], value, tolerance):
+                    yield ('changed', name, series, old_series[series], value)
+            for series, value in old_series.items():
+                if series not in new_series:
+                    yield ('removed', name, series, value, None)
+
+    for name, (offset, length) in old_index.items():
+        if name not in seen_families:
+            for series, value in get_family_series(
+                    read_exposition_family(old_file, offset, length)).items():
+                yield ('removed', name, series, value, None)
+
+
+def is_exposition_changed(old_file: str, new_file: str, tolerance=0.0) -> bool:
+    return next(diff_exposition_files(old_file, new_file, tolerance), None) is not None
+
+
+def get_cardinality_report(snapshot_file: str) -> list:
+    report = []
+    with open(snapshot_file, 'rb') as metrics_file:
+        for family in parse_exposition_families(metrics_file):
+            label_values = {}
+            for name, labels, value in family['samples']:
+                for label, label_value in labels:
+                    label_values.setdefault(label, set()).add(label_value)
+            labels_cardinality = {label: len(values) for label, values in label_values.items()}
+            report.append((family['name'], family['type'], len(family['samples']),
+                           labels_cardinality))
+    return report
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def create_series_string(series: tuple) -> str:
+    name, labels = series
+    if not labels:
+        return name
+    labels_string = ','.join(f'{label}="{escape_label_value(value)}"' for label, value in labels)
+    return f'{name}{{{labels_string}}}'
+
+
+def print_diff_results(changes) -> int:
+    count = 0
+    print('change,series,oldValue,newValue')
+    for change, family, series, old_value, new_value in changes:
+        print(f'{change},{create_series_string(series)},{old_value},{new_value}')
+        count += 1
+    return count
+
+
+def print_cardinality_report(report: list) -> None:
+    print('family,type,series,labels')
+    for family, type, series, labels in sorted(report, key=lambda item: item[2], reverse=True):
+        labels_string = ';'.join(f'{label}={count}' for label, count in sorted(labels.items()))
+        print(f'{family},{type},{series},{labels_string}')
+
+
+def parse_arguments() -> ArgumentParser:
+    parser = ArgumentParser(description='Inspect metrics in the Prometheus text format.')
+    parser.add_argument(
+        '-a', '--action', action='store', choices=['diff', 'cardinality'], required=True,
+        help='Choose one of the available options.')
+    parser.add_argument(
+        'files', nargs='+',
+        help='Snapshot file for cardinality. Old and new snapshot files for diff.')
+    parser.add_argument(
+        '-t', '--tolerance', action='store', type=float, default=0.0,
+        help='Value changes lower or equal to this tolerance are ignored by diff.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.action == 'cardinality':
+        print_cardinality_report(get_cardinality_report(args.files[0]))
+    elif args.action == 'diff':
+        if len(args.files) != 2:
+            print('Inform the old and the new snapshot files.')
+            sys.exit(1)
+        changes = diff_exposition_files(args.files[0], args.files[1], args.tolerance)
+        if print_diff_results(changes):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
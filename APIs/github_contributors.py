@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the local index of repository contributors.
+The index is updated incrementally from the commits and merged pulls since
+the last run and it is used to calculate the contributors metrics.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/commits/commits#list-commits
+# - https://docs.github.com/en/rest/pulls/pulls#list-pull-requests
+
+from datetime import datetime, timezone
+import time
+from github.Repository import Repository
+
+from common import (
+    create_canonical_name,
+    get_github_metrics,
+    get_utc_timestamp,
+    load_state,
+    save_state,
+    )
+from github_team import get_team_members, is_team_member
+
+CONTRIBUTOR_STATUSES = ['first_time', 'returning', 'active']
+
+# Indexes already updated in this run, shared by the metrics using them.
+contributor_indexes = {}
+
+
+def get_index_state_name(repo_id: str) -> str:
+    return f'contributors_{create_canonical_name(repo_id)}.json'
+
+
+def update_contributor(contributors: dict, login: str, timestamp: float) -> dict:
+    # Each contributor is stored with the first and the last time it was seen.
+    first_seen, last_seen = contributors.get(login, [timestamp, timestamp])
+    contributors[login] = [min(first_seen, timestamp), max(last_seen, timestamp)]
+    return contributors
+
+
+def create_contributor_index(repo: Repository) -> dict:
+    # The first run lists the current contributors only once. Their first contribution is
+    # unknown, so they are never counted as first-time contributors.
+    contributors = {}
+    for contributor in repo.get_contributors():
+        contributors[contributor.login] = [0, 0]
+    oldest = time.time() - max(get_github_metrics('timeframe')) * 86400
+    return {'cursor': oldest, 'contributors': contributors}
+
+
+def update_index_from_commits(repo: Repository, contributors: dict, cursor: float) -> dict:
+    since = datetime.fromtimestamp(cursor, timezone.utc)
+    for commit in repo.get_commits(since=since):
+        # Commits from emails not linked to a Github account have no author.
+        if commit.author is None:
+            continue
+        timestamp = get_utc_timestamp(commit.commit.author.date)
+        contributors = update_contributor(contributors, commit.author.login, timestamp)
+    return contributors
+
+
+def update_index_from_pulls(repo: Repository, contributors: dict, cursor: float) -> dict:
+    # Sorted by the last update, so the loop stops on the first pull not updated since cursor.
+    pulls = repo.get_pulls(state='closed', sort='updated', direction='desc')
+    for pull in pulls:
+        if get_utc_timestamp(pull.updated_at) < cursor:
+            break
+        if pull.merged_at is None or get_utc_timestamp(pull.merged_at) < cursor:
+            continue
+        contributors = update_contributor(contributors, pull.user.login,
+                                          get_utc_timestamp(pull.merged_at))
+    return contributors
+
+
+def update_contributor_index(repo: Repository) -> dict:
+    if repo.full_name in contributor_indexes:
+        return contributor_indexes[repo.full_name]
+    state_name = get_index_state_name(repo.full_name)
+    index = load_state(state_name)
+    if not index:
+        index = create_contributor_index(repo)
+    new_cursor = time.time()
+    contributors = index['contributors']
+    contributors = update_index_from_commits(repo, contributors, index['cursor'])
+    contributors = update_index_from_pulls(repo, contributors, index['cursor'])
+    index.update({'cursor': new_cursor, 'contributors': contributors})
+    save_state(state_name, index)
+    contributor_indexes[repo.full_name] = contributors
+    return contributors
+
+
+def count_contributors_by_timeframe(contributors: dict, days: int) -> dict:
+    team_members = get_team_members()
+    oldest = time.time() - days * 86400
+    counts = {(status, team): 0 for status in CONTRIBUTOR_STATUSES for team in ['', '_team']}
+    for login, (first_seen, last_seen) in contributors.items():
+        if last_seen < oldest:
+            continue
+        # Returning contributors were active in the timeframe, but contributed before it.
+        status = 'first_time' if first_seen >= oldest else 'returning'
+        teams = ['', '_team'] if is_team_member(login, team_members) else ['']
+        for team in teams:
+            counts[('active', team)] += 1
+            counts[(status, team)] += 1
+    return counts
+
+
+def get_contributors_metrics(contributors: dict, metric_prefix: str, repo_id: str) -> list:
+    contributors_metrics = []
+    for timeframe in get_github_metrics('timeframe'):
+        counts = count_contributors_by_timeframe(contributors, timeframe)
+        for (status, team), count in counts.items():
+            team_name = ' team' if team else ''
+            contributors_metrics.append({
+                'metric': f'{metric_prefix}_{status}_contributors_{timeframe}days{team}',
+                'value': count,
+                'description': f'Number of {status.replace("_", " ")}{team_name} contributors '
+                               f'within last {timeframe} days on {repo_id}'})
+    return contributors_metrics
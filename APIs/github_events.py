@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the incremental consumer of Github events
+feeds. Only new events are processed in each run and the recent events are
+kept locally to calculate the activity metrics.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/activity/events
+# - https://docs.github.com/en/webhooks-and-events/events/github-event-types
+
+from datetime import datetime
+import re
+import time
+
+from common import (
+    create_canonical_name,
+    get_github_metrics,
+    get_utc_timestamp,
+    load_state,
+    save_state,
+    )
+from github_rest import create_github_url, get_link_urls, request_github_json
+from github_team import get_team_members, is_team_member
+
+# The events API only returns events from the last 90 days, limited to 10 pages.
+EVENTS_RETENTION_DAYS = 90
+EVENTS_MAX_PAGES = 10
+DEFAULT_POLL_INTERVAL = 60
+
+
+def get_feed_path(feed_type: str, feed_id: str) -> str:
+    if feed_type == 'org':
+        return f'orgs/{feed_id}/events'
+    return f'repos/{feed_id}/events'
+
+
+def get_feed_state_name(feed_type: str, feed_id: str) -> str:
+    # One file per feed, so concurrent shards never write the same state.
+    return f'events_{feed_type}_{create_canonical_name(feed_id)}.json'
+
+
+def create_event_record(event: dict) -> list:
+    created_at = datetime.strptime(event['created_at'], '%Y-%m-%dT%H:%M:%SZ')
+    return [event['id'], event['type'], event['actor']['login'], get_utc_timestamp(created_at)]
+
+
+def fetch_new_events(token: str, feed_path: str, feed_state: dict) -> list:
+    last_event_id = int(feed_state.get('last_event_id') or 0)
+    url = create_github_url(feed_path, {'per_page': 100})
+    new_events = []
+    for page in range(EVENTS_MAX_PAGES):
+        # Only the first page is conditional, since it is the one which reveals new events.
+        etag = feed_state.get('etag') if page == 0 else None
+        status, headers, events = request_github_json(token, url, etag)
+        if page == 0:
+            feed_state['poll_interval'] = int(headers.get('X-Poll-Interval',
+                                                          DEFAULT_POLL_INTERVAL))
+            if status == 304:
+                return new_events
+            feed_state['etag'] = headers.get('ETag')
+        for event in events:
+            if int(event['id']) <= last_event_id:
+                return new_events
+            new_events.append(create_event_record(event))
+        url = get_link_urls(headers).get('next')
+        if not url:
+            break
+    return new_events
+
+
+def prune_events(events: list) -> list:
+    oldest = time.time() - EVENTS_RETENTION_DAYS * 86400
+    return [event for event in events if event[3] >= oldest]
+
+
+def poll_events_feed(token: str, feed_type: str, feed_id: str) -> list:
+    state_name = get_feed_state_name(feed_type, feed_id)
+    feed_state = load_state(state_name)
+    events = feed_state.get('events', [])
+    # Github informs the minimum interval between polls in the X-Poll-Interval header.
+    next_poll = feed_state.get('polled_at', 0) + feed_state.get('poll_interval', 0)
+    if time.time() >= next_poll:
+        new_events = fetch_new_events(token, get_feed_path(feed_type, feed_id), feed_state)
+        if new_events:
+            feed_state['last_event_id'] = new_events[0][0]
+        feed_state['polled_at'] = time.time()
+        events = prune_events(new_events + events)
+        feed_state['events'] = events
+        save_state(state_name, feed_state)
+    return events
+
+
+def count_events_by_activity(events: list, days: int) -> dict:
+    team_members = get_team_members()
+    oldest = time.time() - days * 86400
+    # The pairs only seen before the timeframe are counted as 0, so their series don't vanish
+    # while the events are retained.
+    counts = {}
+    for event_id, event_type, actor, created_at in events:
+        actor_type = 'team' if is_team_member(actor, team_members) else 'community'
+        key = (event_type, actor_type)
+        counts.setdefault(key, 0)
+        if created_at >= oldest:
+            counts[key] += 1
+    return counts
+
+
+def count_recent_events(events: list) -> int:
+    oldest = time.time() - EVENTS_RETENTION_DAYS * 86400
+    return len([event for event in events if event[3] >= oldest])
+
+
+def get_event_type_name(event_type: str) -> str:
+    # CamelCase to snake_case, e.g.: PullRequestReviewEvent -> pull_request_review
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', event_type.removesuffix('Event')).lower()
+
+
+def get_activity_metrics(events: list, metric_prefix: str, feed_id: str) -> list:
+    activity_metrics = []
+    for timeframe in get_github_metrics('timeframe'):
+        # Older events are not retained, so longer timeframes would be undercounted.
+        if timeframe > EVENTS_RETENTION_DAYS:
+            continue
+        counts = count_events_by_activity(events, timeframe)
+        for (event_type, actor_type), count in sorted(counts.items()):
+            type_name = get_event_type_name(event_type)
+            activity_metrics.append({
+                'metric': f'{metric_prefix}_events_{type_name}_{actor_type}_{timeframe}days',
+                'value': count,
+                'description': f'Count of {event_type} by {actor_type} within last {timeframe} '
+                               f'days on {feed_id}'})
+    return activity_metrics
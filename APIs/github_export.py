@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the export of issues, pulls, labels and
+workflow runs to partitioned Parquet files. Each export only requests the
+items updated since the previous one and writes them as a new snapshot,
+which can be analyzed without any request to the Github API.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://arrow.apache.org/docs/python/parquet.html
+# - https://docs.github.com/en/rest/issues/issues#list-repository-issues
+# - https://docs.github.com/en/rest/actions/workflow-runs#list-workflow-runs-for-a-repository
+
+from datetime import datetime, timedelta, timezone
+import os
+import sys
+from github import Github
+
+from common import create_canonical_name, load_state, save_state
+from github_pages import iterate_pages
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Workflow runs can only be filtered by creation date, so the recent ones are exported again
+# to get the runs which were still in progress.
+RUNS_LOOKBACK_DAYS = 2
+
+
+def parse_github_date(date_string: str) -> datetime:
+    if not date_string:
+        return None
+    return datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+def get_minutes_between(start_date: datetime, end_date: datetime) -> int:
+    if start_date is None or end_date is None:
+        return None
+    return int((end_date - start_date).total_seconds()) // 60
+
+
+def get_export_schemas() -> dict:
+    # Logins, labels and other repeated strings use dictionary types, so each distinct value is
+    # stored only once per column chunk.
+    text = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    date = pyarrow.timestamp('s', tz='UTC')
+    item_fields = [
+        ('repository', text), ('id', pyarrow.int64()), ('number', pyarrow.int64()),
+        ('title', pyarrow.string()), ('state', text), ('user_login', text),
+        ('author_association', text), ('assignee_logins', pyarrow.list_(text)),
+        ('labels', pyarrow.list_(text)), ('milestone', text), ('comments', pyarrow.int32()),
+        ('created_at', date), ('updated_at', date), ('closed_at', date),
+        ('lifetime_minutes', pyarrow.int64()), ('exported_at', date)]
+    return {
+        'issues': pyarrow.schema(item_fields),
+        'pulls': pyarrow.schema(item_fields + [('merged_at', date), ('draft', pyarrow.bool_())]),
+        'labels': pyarrow.schema([
+            ('repository', text), ('name', text), ('color', pyarrow.string()),
+            ('description', pyarrow.string()), ('exported_at', date)]),
+        'workflow_runs': pyarrow.schema([
+            ('repository', text), ('id', pyarrow.int64()), ('run_number', pyarrow.int64()),
+            ('run_attempt', pyarrow.int32()), ('name', text), ('event', text),
+            ('status', text), ('conclusion', text), ('head_branch', text),
+            ('actor_login', text), ('created_at', date), ('updated_at', date),
+            ('run_started_at', date), ('duration_minutes', pyarrow.int64()),
+            ('exported_at', date)])}
+
+
+def create_item_row(repo_id: str, item: dict, exported_at: datetime) -> dict:
+    created_at = parse_github_date(item['created_at'])
+    updated_at = parse_github_date(item['updated_at'])
+    closed_at = parse_github_date(item['closed_at'])
+    milestone = item['milestone']['title'] if item.get('milestone') else None
+    # Same lifetime of the list-repo-issues and list-repo-pulls actions.
+    return {'repository': repo_id, 'id': item['id'], 'number': item['number'],
+            'title': item['title'], 'state': item['state'],
+            'user_login': item['user']['login'] if item.get('user') else None,
+            'author_association': item.get('author_association'),
+            'assignee_logins': [assignee['login'] for assignee in item.get('assignees') or []],
+            'labels': [label['name'] for label in item.get('labels') or []],
+            'milestone': milestone, 'comments': item.get('comments'),
+            'created_at': created_at, 'updated_at': updated_at, 'closed_at': closed_at,
+            'lifetime_minutes': get_minutes_between(created_at, closed_at or updated_at),
+            'exported_at': exported_at}
+
+
+def create_pull_row(repo_id: str, item: dict, exported_at: datetime) -> dict:
+    row = create_item_row(repo_id, item, exported_at)
+    row.update({'merged_at': parse_github_date(item['pull_request'].get('merged_at')),
+                'draft': item.get('draft')})
+    return row
+
+
+def create_label_row(repo_id: str, label: dict, exported_at: datetime) -> dict:
+    return {'repository': repo_id, 'name': label['name'], 'color': label['color'],
+            'description': label.get('description'), 'exported_at': exported_at}
+
+
+def create_run_row(repo_id: str, run: dict, exported_at: datetime) -> dict:
+    run_started_at = parse_github_date(run.get('run_started_at'))
+    updated_at = parse_github_date(run['updated_at'])
+    duration = None
+    if run['status'] == 'completed':
+        duration = get_minutes_between(run_started_at, updated_at)
+    return {'repository': repo_id, 'id': run['id'], 'run_number': run['run_number'],
+            'run_attempt': run.get('run_attempt'), 'name': run.get('name'),
+            'event': run['event'], 'status': run['status'], 'conclusion': run['conclusion'],
+            'head_branch': run.get('head_branch'),
+            'actor_login': run['actor']['login'] if run.get('actor') else None,
+            'created_at': parse_github_date(run['created_at']), 'updated_at': updated_at,
+            'run_started_at': run_started_at, 'duration_minutes': duration,
+            'exported_at': exported_at}
+
+
+def write_export_table(export_dir: str, table_name: str, repo_id: str, rows: list,
+                       exported_at: datetime) -> int:
+    # Hive style partitions by table, repository and export date. Each export is a new file,
+    # so the latest snapshot of an item is the row with the greatest "updated_at".
+    if not rows:
+        return 0
+    schema = get_export_schemas()[table_name]
+    table = pyarrow.Table.from_pylist(rows, schema=schema)
+    partition_dir = os.path.join(export_dir, table_name,
+                                 f'repo={create_canonical_name(repo_id)}',
+                                 f'export_date={exported_at.strftime("%Y-%m-%d")}')
+    os.makedirs(partition_dir, exist_ok=True)
+    parquet_file = os.path.join(partition_dir, f'part-{exported_at.strftime("%H%M%S")}.parquet')
+    dictionary_columns = [field.name for field in schema
+                          if pyarrow.types.is_dictionary(field.type)]
+    dictionary_columns += [f'{field.name}.list.element' for field in schema
+                           if pyarrow.types.is_list(field.type)]
+    pyarrow.parquet.write_table(table, f'{parquet_file}.tmp', compression='zstd',
+                                use_dictionary=dictionary_columns)
+    os.replace(f'{parquet_file}.tmp', parquet_file)
+    return len(rows)
+
+
+def export_repository_items(session: Github, repo_id: str, export_state: dict,
+                            exported_at: datetime) -> tuple:
+    # The issues listing also returns the pulls, so both are exported with a single listing.
+    params = {'state': 'all', 'sort': 'updated', 'direction': 'asc'}
+    if export_state.get('items_cursor'):
+        params['since'] = export_state['items_cursor']
+    issues = []
+    pulls = []
+    for item in iterate_pages(session, f'repos/{repo_id}/issues', params, None):
+        if item.get('pull_request'):
+            pulls.append(create_pull_row(repo_id, item, exported_at))
+        else:
+            issues.append(create_item_row(repo_id, item, exported_at))
+        export_state['items_cursor'] = max(export_state.get('items_cursor') or '',
+                                           item['updated_at'])
+    return issues, pulls
+
+
+def export_repository_runs(session: Github, repo_id: str, export_state: dict,
+                           exported_at: datetime) -> list:
+    params = {}
+    if export_state.get('runs_cursor'):
+        params['created'] = f">={export_state['runs_cursor']}"
+    runs = [create_run_row(repo_id, run, exported_at)
+            for run in iterate_pages(session, f'repos/{repo_id}/actions/runs', params, None,
+                                     'workflow_runs')]
+    cursor = exported_at - timedelta(days=RUNS_LOOKBACK_DAYS)
+    export_state['runs_cursor'] = cursor.strftime('%Y-%m-%d')
+    return runs
+
+
+def export_repository(session: Github, repo_id: str, export_dir: str) -> dict:
+    if pyarrow is None:
+        print('The pyarrow module is required by the export action.')
+        sys.exit(1)
+    state_name = f'export_{create_canonical_name(repo_id)}.json'
+    export_state = load_state(state_name)
+    exported_at = datetime.now(timezone.utc).replace(microsecond=0)
+    issues, pulls = export_repository_items(session, repo_id, export_state, exported_at)
+    labels = [create_label_row(repo_id, label, exported_at)
+              for label in iterate_pages(session, f'repos/{repo_id}/labels', {}, None)]
+    runs = export_repository_runs(session, repo_id, export_state, exported_at)
+    counts = {
+        'issues': write_export_table(export_dir, 'issues', repo_id, issues, exported_at),
+        'pulls': write_export_table(export_dir, 'pulls', repo_id, pulls, exported_at),
+        'labels': write_export_table(export_dir, 'labels', repo_id, labels, exported_at),
+        'workflow_runs': write_export_table(export_dir, 'workflow_runs', repo_id, runs,
+                                            exported_at)}
+    # The cursors are only saved after all the files are written.
+    save_state(state_name, export_state)
+    return counts
@@ -17,10 +17,15 @@ Author: Marcus Burghardt - https://github.com/marcusburghardt
 # - https://docs.github.com/en/rest
 
 from argparse import ArgumentParser
+from datetime import datetime
+from fnmatch import fnmatch
+import time
 from github import Github
+from github.Issue import Issue
 from github.Milestone import Milestone
 from github.NamedUser import NamedUser
 from github.Organization import Organization
+from github.PullRequest import PullRequest
 from github.Repository import Repository
 from prometheus_client import CollectorRegistry
 
@@ -30,33 +35,63 @@ from common import (
     create_list_from_string,
     parse_filters_string,
     get_delta_time,
+    get_export_dir,
     get_github_labels,
     get_github_metrics,
-    get_github_token,
+    get_github_plan,
     get_old_date,
+    get_shard_index,
+    load_state,
+    lock_state,
+    parse_shard_string,
     print_object_info,
     print_object_info_header,
+    save_state,
     )
+from github_contributors import get_contributors_metrics, update_contributor_index
+from github_events import count_recent_events, get_activity_metrics, poll_events_feed
+from github_export import export_repository
+from github_pages import ParallelPaginatedList
+from github_pool import (
+    collect_token_pool_metrics,
+    get_pool_session,
+    get_session_token,
+    get_token_pool,
+    )
+from github_team import get_team_members, is_team_member
 from prometheus_pushgw import (
     append_pushgateway_metrics,
+    append_shard_status_metrics,
     create_pushgateway_gauge_metric,
     create_pushgateway_registry,
     create_workflows_runs_metric,
     append_workflows_runs_metric,
+    get_shards_status,
     parse_repo_metrics,
     parse_workflow_metrics,
-    push_pushgateway_metrics,
+    push_prometheus_metrics,
     )
+from profiling import span, start_profiling, stop_profiling
+
+# Objects shared by all collectors, targets and pool sessions of a run, so they are requested
+# only once.
+organizations_cache = {}
+repositories_cache = {}
+# Estimated seconds of a collector never measured before.
+DEFAULT_COLLECTOR_COST = 30
+# The token metrics change on every run, so they are pushed in their own group and don't
+# prevent the unchanged collections from being skipped.
+TOKENS_GROUPING_KEY = {'collection': 'github_tokens'}
 
 
 def create_github_session() -> Github:
-    return Github(get_github_token())
+    return get_pool_session(get_token_pool())
 
 
-def count_items_by_owner(items: list, owners: list) -> int:
+def count_items_by_owner(items: list, owners: frozenset) -> int:
     count = 0
     for item in items:
-        if item.user.login in owners:
+        if is_team_member(item.user.login, owners):
             count += 1
     return count
 
@@ -96,19 +131,43 @@ def filter_pulls_from_issues(items: list) -> list:
 
 def filter_repository_open_items_team(items: list) -> list:
     open_items_team = []
-    team_members = get_github_metrics('team')
+    team_members = get_team_members()
     for item in items:
-        if item.user.login in team_members:
+        if is_team_member(item.user.login, team_members):
             open_items_team.append(item)
     return open_items_team
 
 
+def filter_shard_repositories(repositories: list, shard: tuple) -> list:
+    index, shards = shard
+    shard_repositories = []
+    for repo in repositories:
+        if get_shard_index(repo.full_name, shards) == index:
+            shard_repositories.append(repo)
+    return shard_repositories
+
+
+def filter_plan_repositories(repositories: list, include: list, exclude: list) -> list:
+    plan_repositories = []
+    for repo in repositories:
+        if include and not any(fnmatch(repo.full_name, pattern) for pattern in include):
+            continue
+        if exclude and any(fnmatch(repo.full_name, pattern) for pattern in exclude):
+            continue
+        plan_repositories.append(repo)
+    return plan_repositories
+
+
 def get_organization_object(session: Github, org_id: str) -> Organization:
-    return session.get_organization(org_id)
+    if org_id not in organizations_cache:
+        organizations_cache[org_id] = session.get_organization(org_id)
+    return organizations_cache[org_id]
 
 
 def get_repository_object(session: Github, repo_id: str) -> Repository:
-    return session.get_repo(repo_id)
+    if repo_id not in repositories_cache:
+        repositories_cache[repo_id] = session.get_repo(repo_id)
+    return repositories_cache[repo_id]
 
 
 def get_milestone_by_title(repo, milestone_title: str) -> Milestone:
@@ -144,13 +203,13 @@ def get_repository_contributors(session: Github, repo_id: str) -> list:
 
 def get_repository_created_issues(
         session: Github, repo_id: str, days: str, filter_string: str) -> list:
-    open_issues = get_repository_issues(session, repo_id, filter_string, '')
+    open_issues = get_repository_issues_pages(session, repo_id, filter_string)
     return filter_created_items_by_lifetime(open_issues, days)
 
 
 def get_repository_created_pulls(
         session: Github, repo_id: str, days: int, filter_string: str) -> list:
-    open_pulls = get_repository_pulls(session, repo_id, filter_string)
+    open_pulls = get_repository_pulls_pages(session, repo_id, filter_string)
     return filter_created_items_by_lifetime(open_pulls, days)
 
 
@@ -188,6 +247,17 @@ def get_repository_issues(
     return filtered_issues
 
 
+def get_repository_issues_pages(
+        session: Github, repo_id: str, filters_string: str) -> ParallelPaginatedList:
+    # Same query of get_repository_issues without labels, but with pages fetched in parallel.
+    # Only the "none" and "*" values are supported for assignee and milestone filters.
+    filters_dict = create_dict_from_string(filters_string, ',')
+    filters = parse_filters_string(filters_dict, 'issue')
+    params = {'state': filters['state'], 'assignee': filters['assignee'],
+              'milestone': filters['milestone']}
+    return ParallelPaginatedList(session, f'repos/{repo_id}/issues', params, Issue)
+
+
 def get_repository_label_usage_count(session: Github, repo_id: str, label: str) -> None:
     open_filter_string = 'state=open'
     open_issues = get_repository_issues(session, repo_id, open_filter_string, label)
@@ -225,6 +295,16 @@ def get_repository_pulls(session: Github, repo_id: str, filters_string: str) ->
         return repo.get_pulls()
 
 
+def get_repository_pulls_pages(
+        session: Github, repo_id: str, filters_string: str) -> ParallelPaginatedList:
+    # Same query of get_repository_pulls, but with pages fetched in parallel.
+    filters_dict = create_dict_from_string(filters_string, ',')
+    filters = parse_filters_string(filters_dict, 'pull')
+    params = {'state': filters['state'], 'sort': filters['sort'],
+              'direction': filters['direction']}
+    return ParallelPaginatedList(session, f'repos/{repo_id}/pulls', params, PullRequest)
+
+
 def get_items_lifetime_average(items: list, days: int, lifetime_info: dict,
                                state='closed') -> dict:
     # INFO: Getting detailed info from all items can hit the API limits and take long time
@@ -238,7 +318,7 @@ def get_items_lifetime_average(items: list, days: int, lifetime_info: dict,
     lifetime_team = 0
     processed_items = 0
     processed_items_team = 0
-    team_members = get_github_metrics('team')
+    team_members = get_team_members()
 
     for item in items:
         if state == 'closed':
@@ -250,7 +330,7 @@ def get_items_lifetime_average(items: list, days: int, lifetime_info: dict,
         lifetime_in_minutes += delta_time
         processed_items += 1
 
-        if item.user.login in team_members:
+        if is_team_member(item.user.login, team_members):
             lifetime_in_minutes_team += delta_time
             processed_items_team += 1
 
@@ -282,8 +362,7 @@ def collect_created_items(
 
 
 def collect_created_issues_by_team(issues: list) -> int:
-    team_members = get_github_metrics('team')
-    return count_items_by_owner(issues, team_members)
+    return count_items_by_owner(issues, get_team_members())
 
 
 def collect_created_issues(session: Github, repo_id: str, metrics: dict) -> dict:
@@ -295,8 +374,7 @@ def collect_created_issues(session: Github, repo_id: str, metrics: dict) -> dict
 
 
 def collect_created_pulls_by_team(pulls: list) -> int:
-    team_members = get_github_metrics('team')
-    return count_items_by_owner(pulls, team_members)
+    return count_items_by_owner(pulls, get_team_members())
 
 
 def collect_created_pulls(session: Github, repo_id: str, metrics: dict) -> dict:
@@ -307,26 +385,56 @@ def collect_created_pulls(session: Github, repo_id: str, metrics: dict) -> dict:
     return metrics
 
 
-def collect_org_metrics_prometheus(
-        session: Github, org_id: str, registry) -> tuple[CollectorRegistry, list]:
-    for metric in get_github_metrics('org'):
-        if metric == 'members':
-            org_members = get_members_list(session, org_id, 'all')
-            count = org_members.totalCount
-        elif metric == 'admins':
-            org_admins = get_members_list(session, org_id, 'admin')
-            count = org_admins.totalCount
-        elif metric == 'repositories':
-            org_repositories = get_repositories_list(session, org_id)
-            count = org_repositories.totalCount
-        elif metric == 'team_size':
-            count = len(get_github_metrics('team'))
+def collect_org_activity(
+        session: Github, org_id: str, registry: CollectorRegistry) -> CollectorRegistry:
+    events = poll_events_feed(get_session_token(session), 'org', org_id)
+    for metric in get_activity_metrics(events, f'{org_id}_org', org_id):
+        registry = create_pushgateway_gauge_metric(metric['metric'], metric['description'],
+                                                   metric['value'], registry)
+    return registry
+
+
+def collect_org_metric(
+        session: Github, org_id: str, metric: str, registry: CollectorRegistry,
+        org_repositories) -> CollectorRegistry:
+    if metric == 'members':
+        org_members = get_members_list(session, org_id, 'all')
+        count = org_members.totalCount
+    elif metric == 'admins':
+        org_admins = get_members_list(session, org_id, 'admin')
+        count = org_admins.totalCount
+    elif metric == 'repositories':
+        if isinstance(org_repositories, list):
+            count = len(org_repositories)
         else:
-            print(f'Metric {metric} is not available.')
+            count = org_repositories.totalCount
+    elif metric == 'team_size':
+        count = len(get_team_members())
+    elif metric == 'activity':
+        return collect_org_activity(session, org_id, registry)
+    else:
+        print(f'Metric {metric} is not available.')
+        return registry
+    return create_pushgateway_gauge_metric(f'{org_id}_org_{metric}',
+                                           f'Count of {metric} on {org_id} org',
+                                           count, registry)
+
+
+def collect_org_metrics_prometheus(
+        session: Github, org_id: str, registry, org_repositories=None,
+        run=None) -> tuple[CollectorRegistry, list]:
+    if org_repositories is None:
+        org_repositories = get_repositories_list(session, org_id)
+    collectors = get_github_metrics('org')
+    if run:
+        collectors = sort_pending_first(collectors, run['previous_pending'].get(org_id, []))
+    # The org collectors are planned against the deadline like the repository ones.
+    for metric in collectors:
+        if not is_collector_planned(run, org_id, metric):
             continue
-        registry = create_pushgateway_gauge_metric(f'{org_id}_org_{metric}',
-                                                   f'Count of {metric} on {org_id} org',
-                                                   count, registry)
+        start_time = time.time()
+        registry = collect_org_metric(session, org_id, metric, registry, org_repositories)
+        save_collector_cost(run, org_id, metric, start_time)
     return registry, org_repositories
 
 
@@ -382,8 +490,8 @@ def collect_items_lifetime_average(
 def collect_issues_lifetime_average(session: Github, repo_id: str, metrics: dict) -> dict:
     closed_filter = 'state=closed,sort=closed,direction=desc'
     open_filter = 'state=open,sort=opened,direction=desc'
-    closed_issues = get_repository_issues(session, repo_id, closed_filter, '')
-    open_issues = get_repository_issues(session, repo_id, open_filter, '')
+    closed_issues = get_repository_issues_pages(session, repo_id, closed_filter)
+    open_issues = get_repository_issues_pages(session, repo_id, open_filter)
     metrics = collect_items_lifetime_average(repo_id, metrics,
                                              closed_issues, open_issues, 'issues')
     return metrics
@@ -392,8 +500,8 @@ def collect_issues_lifetime_average(session: Github, repo_id: str, metrics: dict
 def collect_pulls_lifetime_average(session: Github, repo_id: str, metrics: dict) -> dict:
     closed_filter = 'state=closed,sort=closed,direction=desc'
     open_filter = 'state=open,sort=opened,direction=desc'
-    closed_pulls = get_repository_pulls(session, repo_id, closed_filter)
-    open_pulls = get_repository_pulls(session, repo_id, open_filter)
+    closed_pulls = get_repository_pulls_pages(session, repo_id, closed_filter)
+    open_pulls = get_repository_pulls_pages(session, repo_id, open_filter)
     metrics = collect_items_lifetime_average(repo_id, metrics,
                                              closed_pulls, open_pulls, 'pulls')
     return metrics
@@ -488,12 +596,12 @@ def collect_repository_open_items(repo_id: str, metrics: dict, items: list, type
 
 
 def collect_repository_open_issues(session: Github, repo_id: str, metrics: dict) -> dict:
-    open_issues = get_repository_issues(session, repo_id, 'state=open', '')
+    open_issues = list(get_repository_issues_pages(session, repo_id, 'state=open'))
     return collect_repository_open_items(repo_id, metrics, open_issues, 'issues')
 
 
 def collect_repository_open_pulls(session: Github, repo_id: str, metrics: dict) -> dict:
-    open_pulls = get_repository_pulls(session, repo_id, 'state=open')
+    open_pulls = list(get_repository_pulls_pages(session, repo_id, 'state=open'))
     return collect_repository_open_items(repo_id, metrics, open_pulls, 'pulls')
 
 
@@ -569,55 +677,339 @@ def collect_workflows_metrics_prometheus(
     return registry
 
 
-def collect_repository_metrics_prometheus(session: Github, repo_id: str) -> list:
+def collect_repository_metric(
+        session: Github, repo_id: str, metric: str, metrics: list) -> list:
     repo_name = create_canonical_name(repo_id)
+    if metric in ['contributors', 'events']:
+        if metric == 'contributors':
+            # The contributors are counted from the local index, updated incrementally.
+            repo = get_repository_object(session, repo_id)
+            count = len(update_contributor_index(repo))
+        elif metric == 'events':
+            # The events feed is consumed incrementally instead of paging all events.
+            events = poll_events_feed(get_session_token(session), 'repo', repo_id)
+            count = count_recent_events(events)
+        description = f'Count of {metric} on {repo_id}'
+        metrics = append_pushgateway_metrics(
+            metrics, f'{repo_name}_{metric}', count, description)
+    elif metric == 'activity':
+        events = poll_events_feed(get_session_token(session), 'repo', repo_id)
+        metrics.extend(get_activity_metrics(events, repo_name, repo_id))
+    elif metric == 'contributors_activity':
+        contributors = update_contributor_index(get_repository_object(session, repo_id))
+        metrics.extend(get_contributors_metrics(contributors, repo_name, repo_id))
+    elif metric == 'general_info':
+        metrics = collect_repository_info(session, repo_id, metrics)
+    elif metric == 'issues_by_label':
+        metrics = collect_repository_issues_by_label(session, repo_id, metrics, 'open')
+    elif metric == 'created_pulls_by_timeframe':
+        metrics = collect_created_pulls(session, repo_id, metrics)
+    elif metric == 'created_issues_by_timeframe':
+        metrics = collect_created_issues(session, repo_id, metrics)
+    elif metric == 'open_issues':
+        metrics = collect_repository_open_issues(session, repo_id, metrics)
+    elif metric == 'open_pulls':
+        metrics = collect_repository_open_pulls(session, repo_id, metrics)
+    elif metric == 'pulls_lifetime_average':
+        metrics = collect_pulls_lifetime_average(session, repo_id, metrics)
+    elif metric == 'issues_lifetime_average':
+        metrics = collect_issues_lifetime_average(session, repo_id, metrics)
+    else:
+        print(f'Metric {metric} is not available.')
+    return metrics
+
 
+def collect_repository_metrics_prometheus(
+        session: Github, repo_id: str, repo_metrics=None) -> list:
     metrics = []
-    for metric in get_github_metrics('repo'):
-        if metric in ['contributors', 'events']:
-            if metric == 'contributors':
-                contributors = get_repository_contributors(session, repo_id)
-                count = contributors.totalCount
-            elif metric == 'events':
-                events = get_repository_events(session, repo_id)
-                count = events.totalCount
-            description = f'Count of {metric} on {repo_id}'
-            metrics = append_pushgateway_metrics(
-                metrics, f'{repo_name}_{metric}', count, description)
-        elif metric == 'general_info':
-            metrics = collect_repository_info(session, repo_id, metrics)
-        elif metric == 'issues_by_label':
-            metrics = collect_repository_issues_by_label(session, repo_id, metrics, 'open')
-        elif metric == 'created_pulls_by_timeframe':
-            metrics = collect_created_pulls(session, repo_id, metrics)
-        elif metric == 'created_issues_by_timeframe':
-            metrics = collect_created_issues(session, repo_id, metrics)
-        elif metric == 'open_issues':
-            metrics = collect_repository_open_issues(session, repo_id, metrics)
-        elif metric == 'open_pulls':
-            metrics = collect_repository_open_pulls(session, repo_id, metrics)
-        elif metric == 'pulls_lifetime_average':
-            metrics = collect_pulls_lifetime_average(session, repo_id, metrics)
-        elif metric == 'issues_lifetime_average':
-            metrics = collect_issues_lifetime_average(session, repo_id, metrics)
-        else:
-            print(f'Metric {metric} is not available.')
+    for metric in repo_metrics or get_github_metrics('repo'):
+        with span(metric, 'collector', repository=repo_id):
+            metrics = collect_repository_metric(session, repo_id, metric, metrics)
+    return metrics
+
+
+def get_repository_activity(repo: Repository) -> dict:
+    # These signals come with the repositories listing, so they cost no extra request.
+    return {'pushed_at': str(repo.pushed_at), 'updated_at': str(repo.updated_at),
+            'open_issues_count': repo.open_issues_count}
+
+
+def get_repository_last_event_id(session: Github, repo: Repository) -> str:
+    # The events feed is polled with its ETag, so an unchanged repository costs only a
+    # "304 Not Modified" response, which doesn't count for the rate limit.
+    events = poll_events_feed(get_session_token(session), 'repo', repo.full_name)
+    if events:
+        return events[0][0]
+    return None
+
+
+def is_repository_unchanged(activity: dict, previous: dict) -> bool:
+    if not previous:
+        return False
+    max_age = get_github_metrics('adaptive_max_age') * 60
+    if datetime.now().timestamp() - previous['refreshed_at'] > max_age:
+        return False
+    for signal in activity.keys():
+        if previous.get(signal) != activity[signal]:
+            return False
+    return True
+
+
+def collect_repository_metrics_adaptive(
+        session: Github, repo: Repository, repo_metrics: list, activity_state: dict,
+        run=None) -> list:
+    # Expensive collectors only run for repositories with activity since the last run. The
+    # previous metrics are reused for the others until they are older than the max age.
+    collectors = list(repo_metrics or get_github_metrics('repo'))
+    previous = activity_state.get(repo.full_name)
+    if is_run_expired(run):
+        # Past the deadline, the repository is left for the next run without any request.
+        run['pending'][repo.full_name] = collectors
+        if previous and previous.get('collectors') == collectors:
+            return previous['metrics']
+        return []
+    activity = get_repository_activity(repo)
+    activity['event_id'] = get_repository_last_event_id(session, repo)
+    # Metrics stored with other collectors are not reused.
+    activity['collectors'] = collectors
+    if is_repository_unchanged(activity, previous):
+        return previous['metrics']
+    metrics = collect_repository_metrics_deadline(session, repo.full_name, repo_metrics, run)
+    if run and repo.full_name in run['pending']:
+        # Partial metrics are not reused. The repository is collected again in the next run.
+        return metrics
+    activity.update({'refreshed_at': datetime.now().timestamp(), 'metrics': metrics})
+    activity_state[repo.full_name] = activity
+    return metrics
+
+
+def collect_repository_metrics(
+        session: Github, repo: Repository, repo_metrics: list, activity_state,
+        run=None) -> list:
+    with span(repo.full_name, 'repository'):
+        if activity_state is None:
+            return collect_repository_metrics_deadline(session, repo.full_name, repo_metrics,
+                                                       run)
+        return collect_repository_metrics_adaptive(session, repo, repo_metrics,
+                                                   activity_state, run)
+
+
+def create_collection_run(state_name: str, deadline: int) -> dict:
+    # The run keeps the collectors left for the next run and the duration of each collector,
+    # used to estimate if it still fits before the deadline.
+    if not deadline:
+        return None
+    state_name = f'{state_name}.json'
+    state = load_state(state_name)
+    return {'state_name': state_name, 'deadline': time.time() + deadline * 60,
+            'previous_pending': state.get('pending', {}), 'pending': {},
+            'costs': state.get('costs', {})}
+
+
+def save_collection_run(run: dict) -> None:
+    if run is None:
+        return
+    if run['pending']:
+        print(f"Deadline reached. {len(run['pending'])} repositories or orgs left for the "
+              f"next run.")
+    save_state(run['state_name'], {'pending': run['pending'], 'costs': run['costs']})
+
+
+def get_collection_run_name(target: str, shard) -> str:
+    if shard:
+        return f'collection_{create_canonical_name(target)}_{shard[0]}of{shard[1]}'
+    return f'collection_{create_canonical_name(target)}'
+
+
+def sort_pending_first(items: list, pending: list, key=None) -> list:
+    # What was left by the previous run is collected first. The sort is stable.
+    key = key or (lambda item: item)
+    return sorted(items, key=lambda item: key(item) not in pending)
+
+
+def is_run_expired(run) -> bool:
+    return run is not None and time.time() >= run['deadline']
+
+
+def is_collector_planned(run, repo_id: str, collector: str) -> bool:
+    if run is None:
+        return True
+    estimate = run['costs'].get(repo_id, {}).get(collector, DEFAULT_COLLECTOR_COST)
+    if time.time() + estimate <= run['deadline']:
+        return True
+    run['pending'].setdefault(repo_id, []).append(collector)
+    return False
+
+
+def save_collector_cost(run, repo_id: str, collector: str, start_time: float) -> None:
+    if run is not None:
+        run['costs'].setdefault(repo_id, {})[collector] = round(time.time() - start_time, 3)
+
+
+def collect_repository_metrics_deadline(
+        session: Github, repo_id: str, repo_metrics: list, run) -> list:
+    if run is None:
+        return collect_repository_metrics_prometheus(session, repo_id, repo_metrics)
+    metrics = []
+    collectors = sort_pending_first(repo_metrics or get_github_metrics('repo'),
+                                    run['previous_pending'].get(repo_id, []))
+    for collector in collectors:
+        if not is_collector_planned(run, repo_id, collector):
             continue
+        start_time = time.time()
+        metrics.extend(collect_repository_metrics_prometheus(session, repo_id, [collector]))
+        save_collector_cost(run, repo_id, collector, start_time)
     return metrics
 
 
-def push_metrics_prometheus(session: Github, org_id: str, repo_id: str) -> None:
+def collect_workflows_metrics_deadline(
+        session: Github, repo_id: str, registry: CollectorRegistry, run) -> CollectorRegistry:
+    if not is_collector_planned(run, repo_id, 'workflows'):
+        return registry
+    start_time = time.time()
+    with span('workflows', 'collector', repository=repo_id):
+        registry = collect_workflows_metrics_prometheus(session, repo_id, registry)
+    save_collector_cost(run, repo_id, 'workflows', start_time)
+    return registry
+
+
+def get_activity_state_name(target: str, shard) -> str:
+    # Targets and shards run concurrently and collect different metrics, so each one keeps its
+    # own state, like the collection run.
+    return f'{get_collection_run_name(target, shard)}_activity.json'
+
+
+def push_collection_metrics(
+        registry: CollectorRegistry, start_date: datetime, repositories: list, shard,
+        run=None) -> None:
+    replace = not (run and run['pending'])
+    if shard:
+        duration = get_delta_time(start_date, datetime.now(), 's')
+        registry = append_shard_status_metrics(registry, len(repositories), duration)
+        grouping_key = {'shard': str(shard[0]), 'shards': str(shard[1])}
+    else:
+        grouping_key = None
+    tokens_registry = collect_token_pool_metrics(get_token_pool(), CollectorRegistry())
+    with span('push', 'push'):
+        push_prometheus_metrics(registry, grouping_key, replace)
+        push_prometheus_metrics(tokens_registry, dict(grouping_key or {}, **TOKENS_GROUPING_KEY))
+
+
+def push_metrics_prometheus(
+        session: Github, org_id: str, repo_id: str, shard=None, adaptive=False,
+        deadline=0) -> None:
+    start_date = datetime.now()
     registry = create_pushgateway_registry()
-    registry, org_repositories = collect_org_metrics_prometheus(session, org_id, registry)
+    run = create_collection_run(get_collection_run_name(f'{org_id}_{repo_id}', shard), deadline)
+    activity_state = None
+    if adaptive:
+        activity_state = load_state(get_activity_state_name(f'{org_id}_{repo_id}', shard))
+    # Org metrics are collected only once, by the first shard, to avoid duplicated API work.
+    if shard is None or shard[0] == 1:
+        with span(org_id, 'organization'):
+            registry, org_repositories = collect_org_metrics_prometheus(session, org_id,
+                                                                        registry, run=run)
+    else:
+        org_repositories = get_repositories_list(session, org_id)
     if repo_id == 'all':
-        for repo in org_repositories:
-            repo_metrics = collect_repository_metrics_prometheus(session, repo.full_name)
+        if shard:
+            org_repositories = filter_shard_repositories(org_repositories, shard)
+        repositories = list(org_repositories)
+        if run:
+            repositories = sort_pending_first(repositories, run['previous_pending'],
+                                              key=lambda repo: repo.full_name)
+        for repo in repositories:
+            # Each repository is collected with the token which has more remaining requests.
+            repo_session = get_pool_session(get_token_pool())
+            repo_metrics = collect_repository_metrics(repo_session, repo, None, activity_state,
+                                                      run)
             registry = parse_repo_metrics(repo_metrics, registry)
     else:
-        repo_metrics = collect_repository_metrics_prometheus(session, repo_id)
+        repo = get_repository_object(session, repo_id)
+        repo_metrics = collect_repository_metrics(session, repo, None, activity_state, run)
         registry = parse_repo_metrics(repo_metrics, registry)
-        registry = collect_workflows_metrics_prometheus(session, repo_id, registry)
-    push_pushgateway_metrics(registry)
+        registry = collect_workflows_metrics_deadline(session, repo_id, registry, run)
+    push_collection_metrics(registry, start_date, org_repositories, shard, run)
+    save_collection_run(run)
+    if adaptive:
+        save_state(get_activity_state_name(f'{org_id}_{repo_id}', shard), activity_state)
+
+
+def create_plan_targets(session: Github, plan: dict) -> tuple[dict, dict]:
+    # Each org is listed only once. The listed repositories are reused by the org metrics and
+    # by the repositories collection.
+    org_repositories = {}
+    targets = {}
+    for org in plan['orgs']:
+        repositories = list(get_repositories_list(session, org['name']))
+        org_repositories[org['name']] = repositories
+        for repo in repositories:
+            repositories_cache[repo.full_name] = repo
+        for repo in filter_plan_repositories(repositories, org.get('include'),
+                                             org.get('exclude')):
+            targets.setdefault(repo.full_name, {'metrics': org.get('metrics'),
+                                                'workflows': False})
+    # Explicit repositories override the org settings and also collect workflows metrics,
+    # like a single repository collection.
+    for repo in plan['repos']:
+        targets[repo['name']] = {'metrics': repo.get('metrics'), 'workflows': True}
+    return org_repositories, targets
+
+
+def push_metrics_plan(session: Github, shard=None, adaptive=False, deadline=0) -> None:
+    plan = get_github_plan()
+    if not plan['orgs'] and not plan['repos']:
+        # An empty push would replace the job group and wipe the metrics already pushed.
+        print('The plan in the github section of the apis.yml file has no orgs or repos.')
+        exit(1)
+    start_date = datetime.now()
+    registry = create_pushgateway_registry()
+    run = create_collection_run(get_collection_run_name('plan', shard), deadline)
+    activity_state = None
+    if adaptive:
+        activity_state = load_state(get_activity_state_name('plan', shard))
+    org_repositories, targets = create_plan_targets(session, plan)
+    if shard is None or shard[0] == 1:
+        for org_id, repositories in org_repositories.items():
+            with span(org_id, 'organization'):
+                registry, _ = collect_org_metrics_prometheus(session, org_id, registry,
+                                                             repositories, run)
+    repo_ids = sorted(targets.keys())
+    if shard:
+        repo_ids = [repo_id for repo_id in repo_ids
+                    if get_shard_index(repo_id, shard[1]) == shard[0]]
+    if run:
+        repo_ids = sort_pending_first(repo_ids, run['previous_pending'])
+    for repo_id in repo_ids:
+        repo_session = get_pool_session(get_token_pool())
+        # Listed repositories are already cached, so their activity signals are free.
+        repo = get_repository_object(session, repo_id)
+        repo_metrics = collect_repository_metrics(repo_session, repo,
+                                                  targets[repo_id]['metrics'], activity_state,
+                                                  run)
+        registry = parse_repo_metrics(repo_metrics, registry)
+        if targets[repo_id]['workflows']:
+            registry = collect_workflows_metrics_deadline(repo_session, repo_id, registry, run)
+    push_collection_metrics(registry, start_date, repo_ids, shard, run)
+    save_collection_run(run)
+    if adaptive:
+        save_state(get_activity_state_name('plan', shard), activity_state)
+
+
+def print_shards_status(shards_status: list) -> None:
+    print('shard,shards,repositories,durationSeconds,completedAt')
+    for status in shards_status:
+        completed_at = None
+        if status['completed_at']:
+            completed_at = datetime.fromtimestamp(status['completed_at'])
+        print(f"{status['shard']},{status['shards']},{status['repositories']},"
+              f"{status['duration_seconds']},{completed_at}")
+
+    for shards in set(status['shards'] for status in shards_status):
+        reported = [status['shard'] for status in shards_status if status['shards'] == shards]
+        missing = [str(index) for index in range(1, shards + 1) if index not in reported]
+        if missing:
+            print(f"Missing shards of {shards}: {','.join(missing)}")
 
 
 def print_results(results: list, object_type: str, args) -> str:
@@ -662,7 +1054,7 @@ def parse_arguments() -> ArgumentParser:
                  'list-repo-infos', 'list-repo-labels', 'list-repo-events',
                  'list-repo-issues', 'list-repo-old-issues', 'calc-repo-issues-lifetime',
                  'list-repo-pulls', 'list-repo-old-pulls', 'calc-repo-pulls-lifetime',
-                 'push-metrics-prometheus'],
+                 'push-metrics-prometheus', 'push-metrics-plan', 'shards-status', 'export'],
         help='Choose one of the available options.')
     parser.add_argument(
         '-c', '--count', action='store_true',
@@ -677,11 +1069,26 @@ def parse_arguments() -> ArgumentParser:
     group.add_argument(
         '-l', '--labels', action='store', default='',
         help='Comma separated labels used to filter the results.')
+    parser.add_argument(
+        '-s', '--shard', action='store', default='',
+        help='Collect only the "i/N" shard of the org repositories, e.g.: 1/4')
+    parser.add_argument(
+        '--adaptive', action='store_true',
+        help='Collect again only the repositories with activity since the last run.')
+    parser.add_argument(
+        '--deadline', action='store', type=int, default=0,
+        help='Minutes to stop the collection and push the finished metrics. '
+             'What is left is collected first in the next run.')
+    parser.add_argument(
+        '--profile', action='store', default='',
+        help='Folder to store the trace, the cProfile dump and the summary of the run.')
+    parser.add_argument(
+        '--export-dir', action='store', default='',
+        help='Folder of the Parquet files written by the export action.')
     return parser.parse_args()
 
 
-def main():
-    args = parse_arguments()
+def run_action(args) -> None:
     ORG = args.org
     REPOSITORY = args.repository
     ACTION = args.action
@@ -754,11 +1161,52 @@ def main():
                                                    lifetime_info, 'open')
         print_lifetime_results(lifetime_info, 'pulls', DAYS)
     elif ACTION == 'push-metrics-prometheus':
-        push_metrics_prometheus(ghs, ORG, REPOSITORY)
+        shard = None
+        if args.shard:
+            if REPOSITORY != 'all':
+                print('The shard option is only applicable when collecting all repositories.')
+                exit(1)
+            shard = parse_shard_string(args.shard)
+        # Overlapping runs for the same target would compete for the rate limit.
+        lock = lock_state(f'{get_collection_run_name(f"{ORG}_{REPOSITORY}", shard)}.lock')
+        push_metrics_prometheus(ghs, ORG, REPOSITORY, shard, args.adaptive, args.deadline)
+        lock.close()
+        print("Metrics successfully sent!")
+    elif ACTION == 'push-metrics-plan':
+        shard = None
+        if args.shard:
+            shard = parse_shard_string(args.shard)
+        lock = lock_state(f"{get_collection_run_name('plan', shard)}.lock")
+        push_metrics_plan(ghs, shard, args.adaptive, args.deadline)
+        lock.close()
         print("Metrics successfully sent!")
+    elif ACTION == 'shards-status':
+        print_shards_status(get_shards_status())
+    elif ACTION == 'export':
+        if REPOSITORY == 'all':
+            repo_ids = [repo.full_name for repo in get_repositories_list(ghs, ORG)]
+        else:
+            repo_ids = [REPOSITORY]
+        export_dir = args.export_dir or get_export_dir()
+        print('repository,issues,pulls,labels,workflowRuns')
+        for repo_id in repo_ids:
+            counts = export_repository(get_pool_session(get_token_pool()), repo_id, export_dir)
+            print(f"{repo_id},{counts['issues']},{counts['pulls']},{counts['labels']},"
+                  f"{counts['workflow_runs']}")
     else:
         print("Action not found!")
 
 
+def main():
+    args = parse_arguments()
+    if args.profile:
+        start_profiling(args.profile)
+    try:
+        run_action(args)
+    finally:
+        if args.profile:
+            stop_profiling()
+
+
 if __name__ == '__main__':
     main()
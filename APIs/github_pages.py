@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the parallel paginator for large listings.
+The pages are requested concurrently, but the items are returned in the same
+order of the API, so the consumers can still stop on the first old item.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/guides/using-pagination-in-the-rest-api
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from github import Github
+
+from github_pool import get_session_token
+from github_rest import create_github_url, get_link_urls, get_page_number, request_github_json
+
+PER_PAGE = 100
+# Pages requested ahead of the consumer. It also limits the requests wasted when the consumer
+# stops early.
+PAGE_WORKERS = 4
+
+
+def get_page_items(data, items_key: str) -> list:
+    # Some listings, like the workflow runs, return the items inside an object.
+    if items_key:
+        return data[items_key]
+    return data
+
+
+def fetch_page_items(token: str, url: str, items_key: str) -> list:
+    status, headers, data = request_github_json(token, url)
+    return get_page_items(data, items_key)
+
+
+def create_page_item(session: Github, item_class, item: dict):
+    # Raw items are returned when no PyGithub class is informed.
+    if item_class is None:
+        return item
+    return session.create_from_raw_data(item_class, item)
+
+
+def iterate_pages(session: Github, path: str, params: dict, item_class, items_key=None):
+    token = get_session_token(session)
+    params = dict(params, per_page=PER_PAGE)
+    status, headers, data = request_github_json(token, create_github_url(path, params))
+    for item in get_page_items(data, items_key):
+        yield create_page_item(session, item_class, item)
+
+    last_url = get_link_urls(headers).get('last')
+    if not last_url:
+        return
+    urls = iter(create_github_url(path, dict(params, page=page))
+                for page in range(2, get_page_number(last_url) + 1))
+    with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+        pending = deque()
+        try:
+            for url in urls:
+                pending.append(executor.submit(fetch_page_items, token, url, items_key))
+                if len(pending) == PAGE_WORKERS:
+                    break
+            while pending:
+                items = pending.popleft().result()
+                url = next(urls, None)
+                if url:
+                    pending.append(executor.submit(fetch_page_items, token, url, items_key))
+                for item in items:
+                    yield create_page_item(session, item_class, item)
+        finally:
+            # Pages not started yet are discarded when the consumer stops early.
+            for future in pending:
+                future.cancel()
+
+
+class ParallelPaginatedList:
+    # Like the PyGithub PaginatedList, the items already fetched are kept, so the list can be
+    # iterated multiple times and the pages are only requested when needed.
+    def __init__(self, session: Github, path: str, params: dict, item_class):
+        self.items = []
+        self.pages = iterate_pages(session, path, params, item_class)
+
+    def __iter__(self):
+        position = 0
+        while True:
+            if position == len(self.items):
+                item = next(self.pages, None)
+                if item is None:
+                    return
+                self.items.append(item)
+            yield self.items[position]
+            position += 1
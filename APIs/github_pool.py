@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the pool of Github tokens, which spreads the
+API requests among multiple tokens and their respective rate limits.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/overview/resources-in-the-rest-api#rate-limiting
+
+import time
+from github import Github
+from prometheus_client import CollectorRegistry
+
+from common import get_github_tokens
+from prometheus_pushgw import append_labeled_gauge_metric, create_labeled_gauge_metric
+
+token_pool = []
+
+
+def create_token_pool_entry(token: str) -> dict:
+    return {'token': token, 'session': Github(token), 'remaining': None, 'limit': None,
+            'reset': 0, 'selected': 0}
+
+
+def get_token_pool() -> list:
+    if not token_pool:
+        for token in get_github_tokens():
+            token_pool.append(create_token_pool_entry(token))
+    if not token_pool:
+        raise Exception("No Github token was found in the creds file!")
+    return token_pool
+
+
+def get_token_label(token: str) -> str:
+    # Only the token suffix is exposed, which is enough to identify it.
+    return f'...{token[-4:]}'
+
+
+def set_token_rate_limit(entry: dict, remaining: int, limit: int, reset: int) -> dict:
+    # The requests are sent by PyGithub and by the Rest helpers, so each one may have an older
+    # view of the rate limit. A later reset is a new window and, in the same window, the lowest
+    # remaining is the most recent one.
+    if entry['remaining'] is None or reset > entry['reset']:
+        entry.update({'remaining': remaining, 'limit': limit, 'reset': reset})
+    elif reset == entry['reset']:
+        entry['remaining'] = min(entry['remaining'], remaining)
+    return entry
+
+
+def update_token_rate_limit(entry: dict) -> dict:
+    # PyGithub keeps the rate limit from the last response headers. It is only requested to the
+    # API, which doesn't count for the rate limit, when the token was not used yet.
+    remaining, limit = entry['session'].rate_limiting
+    return set_token_rate_limit(entry, remaining, limit,
+                                entry['session'].rate_limiting_resettime)
+
+
+def record_token_rate_limit(token: str, headers) -> None:
+    # Only the core rate limit is tracked, which is the same one of PyGithub.
+    if not headers or headers.get('X-RateLimit-Remaining') is None:
+        return
+    if headers.get('X-RateLimit-Resource', 'core') != 'core':
+        return
+    for entry in token_pool:
+        if entry['token'] == token:
+            set_token_rate_limit(entry, int(headers['X-RateLimit-Remaining']),
+                                 int(headers['X-RateLimit-Limit']),
+                                 int(headers['X-RateLimit-Reset']))
+
+
+def is_token_available(entry: dict) -> bool:
+    return entry['remaining'] > 0 or entry['reset'] <= time.time()
+
+
+def get_pool_entry(pool: list) -> dict:
+    for entry in pool:
+        update_token_rate_limit(entry)
+    available = [entry for entry in pool if is_token_available(entry)]
+    if not available:
+        # All tokens are exhausted and out of rotation until the first reset.
+        entry = min(pool, key=lambda entry: entry['reset'])
+        wait = max(entry['reset'] - time.time(), 0) + 1
+        print(f"All Github tokens are exhausted. Waiting {int(wait)} seconds for "
+              f"{get_token_label(entry['token'])} reset.")
+        time.sleep(wait)
+        return get_pool_entry(pool)
+    entry = max(available, key=lambda entry: entry['remaining'])
+    entry['selected'] += 1
+    return entry
+
+
+def get_pool_session(pool: list) -> Github:
+    return get_pool_entry(pool)['session']
+
+
+def get_session_token(session: Github) -> str:
+    for entry in get_token_pool():
+        if entry['session'] is session:
+            return entry['token']
+    return None
+
+
+def collect_token_pool_metrics(pool: list, registry: CollectorRegistry) -> CollectorRegistry:
+    metrics = {
+        'remaining': create_labeled_gauge_metric(
+            'communitymon_github_token_remaining_requests',
+            'Remaining requests in the current rate limit window of the token', ['token'],
+            registry),
+        'used': create_labeled_gauge_metric(
+            'communitymon_github_token_used_requests',
+            'Used requests in the current rate limit window of the token', ['token'], registry),
+        'reset': create_labeled_gauge_metric(
+            'communitymon_github_token_reset_timestamp_seconds',
+            'Unix time when the rate limit of the token is reset', ['token'], registry),
+        'selected': create_labeled_gauge_metric(
+            'communitymon_github_token_selections',
+            'Count of times the token was selected during the collection', ['token'],
+            registry)}
+    for entry in pool:
+        update_token_rate_limit(entry)
+        labels = {'token': get_token_label(entry['token'])}
+        append_labeled_gauge_metric(metrics['remaining'], labels, entry['remaining'])
+        append_labeled_gauge_metric(metrics['used'], labels, entry['limit'] - entry['remaining'])
+        append_labeled_gauge_metric(metrics['reset'], labels, entry['reset'])
+        append_labeled_gauge_metric(metrics['selected'], labels, entry['selected'])
+    return registry
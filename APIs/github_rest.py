@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate direct requests to the Github Rest API for
+the cases not covered by PyGithub, like conditional requests and polling
+headers.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/overview/resources-in-the-rest-api#conditional-requests
+# - https://docs.github.com/en/rest/guides/using-pagination-in-the-rest-api
+# - https://docs.github.com/en/rest/overview/rate-limits-for-the-rest-api#exceeding-the-rate-limit
+
+import json
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from github_pool import record_token_rate_limit
+from profiling import record_http_span
+
+API_URL = 'https://api.github.com'
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+# Without a "Retry-After" header, Github asks to wait at least one minute after a secondary
+# rate limit.
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+
+def create_github_url(path: str, params=None) -> str:
+    url = f'{API_URL}/{path.lstrip("/")}'
+    if params:
+        url = f'{url}?{urllib.parse.urlencode(params)}'
+    return url
+
+
+def get_link_urls(headers) -> dict:
+    links = {}
+    for link in (headers.get('Link') or '').split(','):
+        match = re.search(r'<([^>]+)>;\s*rel="(\w+)"', link)
+        if match:
+            links[match.group(2)] = match.group(1)
+    return links
+
+
+def get_page_number(url: str) -> int:
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    return int(query.get('page', ['1'])[0])
+
+
+def get_rate_limit_wait(error: urllib.error.HTTPError, attempt: int) -> float:
+    # Returns None when the error is not caused by a primary or secondary rate limit.
+    if error.code not in [403, 429]:
+        return None
+    if error.headers.get('Retry-After'):
+        return int(error.headers['Retry-After'])
+    if error.headers.get('X-RateLimit-Remaining') == '0':
+        return max(int(error.headers['X-RateLimit-Reset']) - time.time(), 0) + 1
+    if error.code == 429 or b'rate limit' in error.read().lower():
+        return SECONDARY_RATE_LIMIT_WAIT * 2 ** attempt
+    return None
+
+
+def request_github_json(token: str, url: str, etag=None) -> tuple:
+    # Conditional requests answered with "304 Not Modified" don't count for the rate limit.
+    # The rate limit headers of every response are recorded in the token pool, since these
+    # requests are not seen by PyGithub.
+    headers = {'Accept': 'application/vnd.github+json', 'Authorization': f'Bearer {token}'}
+    if etag:
+        headers['If-None-Match'] = etag
+    for attempt in range(MAX_RETRIES + 1):
+        request = urllib.request.Request(url, headers=headers)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                content = response.read()
+            record_http_span('GET', url, response.status, len(content), start)
+            record_token_rate_limit(token, response.headers)
+            return response.status, response.headers, json.loads(content)
+        except urllib.error.HTTPError as error:
+            record_http_span('GET', url, error.code, 0, start)
+            record_token_rate_limit(token, error.headers)
+            if error.code == 304:
+                return error.code, error.headers, None
+            wait = get_rate_limit_wait(error, attempt)
+            if wait is None or attempt == MAX_RETRIES:
+                raise
+        print(f'Github rate limit reached on {url}. Retrying in {int(wait)} seconds.')
+        time.sleep(wait)
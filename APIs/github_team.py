@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the team members resolution. The team can
+be defined by logins and by Github org teams, whose membership is stored
+locally and refreshed with conditional requests.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.github.com/en/rest/teams/members#list-team-members
+
+import time
+
+from common import (
+    create_canonical_name,
+    get_github_metrics,
+    load_state,
+    save_state,
+    )
+from github_pool import get_pool_entry, get_token_pool
+from github_rest import create_github_url, get_link_urls, request_github_json
+
+# Members resolved in this run, shared by all the team classifications.
+team_members = None
+
+
+def get_team_state_name(team_id: str) -> str:
+    return f'team_{create_canonical_name(team_id)}.json'
+
+
+def fetch_team_pages(token: str, team_id: str, pages: list) -> list:
+    # Each page is requested with its own ETag, so an unchanged team costs only conditional
+    # requests, which don't count for the rate limit.
+    org_id, team_slug = team_id.split('/', 1)
+    path = f'orgs/{org_id}/teams/{team_slug}/members'
+    new_pages = []
+    page = 1
+    while True:
+        url = create_github_url(path, {'per_page': 100, 'page': page})
+        previous = pages[page - 1] if page <= len(pages) else {}
+        status, headers, members = request_github_json(token, url, previous.get('etag'))
+        if status == 304:
+            new_pages.append(previous)
+            has_next = page < len(pages)
+        else:
+            new_pages.append({'etag': headers.get('ETag'),
+                              'members': [member['login'] for member in members]})
+            has_next = 'next' in get_link_urls(headers)
+        if not has_next:
+            return new_pages
+        page += 1
+
+
+def get_github_team_members(team_id: str) -> list:
+    state_name = get_team_state_name(team_id)
+    team_state = load_state(state_name)
+    ttl = get_github_metrics('team_ttl') * 60
+    if time.time() - team_state.get('refreshed_at', 0) > ttl:
+        token = get_pool_entry(get_token_pool())['token']
+        team_state['pages'] = fetch_team_pages(token, team_id, team_state.get('pages', []))
+        team_state['refreshed_at'] = time.time()
+        save_state(state_name, team_state)
+    return [login for page in team_state['pages'] for login in page['members']]
+
+
+def get_team_members() -> frozenset:
+    # Logins are case insensitive on Github. A frozenset gives constant time lookups for the
+    # classification of every item.
+    global team_members
+    if team_members is None:
+        members = []
+        for entry in get_github_metrics('team') or []:
+            if '/' in entry:
+                members.extend(get_github_team_members(entry))
+            else:
+                members.append(entry)
+        team_members = frozenset(login.lower() for login in members)
+    return team_members
+
+
+def is_team_member(login: str, members: frozenset) -> bool:
+    return login.lower() in members
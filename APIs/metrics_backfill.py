@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Script created to rebuild the history of the repository metrics from local
+issues and pulls data and write it in the OpenMetrics format, which can be
+imported in the Prometheus TSDB by promtool.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://prometheus.io/docs/prometheus/latest/storage/#backfilling-from-openmetrics-format
+# - https://github.com/OpenObservability/OpenMetrics/blob/main/specification/OpenMetrics.md
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+import sys
+
+from common import (
+    create_canonical_name,
+    create_dict_from_string,
+    get_delta_time,
+    get_github_metrics,
+    )
+from github_team import get_team_members, is_team_member
+
+DAY_SECONDS = 86400
+
+
+def parse_item_date(date_string: str) -> datetime:
+    if date_string in ['', 'None']:
+        return None
+    item_date = datetime.fromisoformat(date_string)
+    if item_date.tzinfo:
+        item_date = item_date.astimezone(timezone.utc).replace(tzinfo=None)
+    return item_date
+
+
+def read_items_file(items_file: str) -> list:
+    # The file is expected in the format printed by the list-repo-issues and list-repo-pulls
+    # actions. The items must be listed only with the "state=all" filter, which keeps the
+    # default filters of the collectors, so the series cover the same items of the pushed
+    # metrics. The title is the last column and may use commas, so it is never split.
+    items = []
+    with open(items_file, 'r') as csv_file:
+        for line in csv_file:
+            fields = line.rstrip('\n').split(',', 10)
+            if fields[0] == 'number' or len(fields) < 11:
+                continue
+            assignee = fields[9]
+            if assignee == 'None':
+                assignee = None
+            items.append({'created_at': parse_item_date(fields[3]),
+                          'updated_at': parse_item_date(fields[4]),
+                          'closed_at': parse_item_date(fields[5]),
+                          'reporter': fields[8],
+                          'assignee': assignee})
+    return items
+
+
+def get_day_index(start_date: datetime, item_date: datetime) -> int:
+    # Index of the first daily sample taken after the informed date.
+    return int((item_date - start_date).total_seconds() // DAY_SECONDS) + 1
+
+
+def add_interval(series: list, start: int, end: int, value=1) -> None:
+    # The series are difference arrays, so each item costs O(1) regardless the history size.
+    days = len(series) - 1
+    start = min(max(start, 0), days)
+    end = min(max(end, 0), days)
+    if start < end:
+        series[start] += value
+        series[end] -= value
+
+
+def accumulate_series(series: list) -> list:
+    total = 0
+    values = []
+    for delta in series[:-1]:
+        total += delta
+        values.append(total)
+    return values
+
+
+def get_window_sums(buckets: list, window: int) -> list:
+    # Sum of the daily buckets before each sample, within the last "window" days.
+    sums = []
+    total = 0
+    for day in range(len(buckets)):
+        sums.append(total)
+        total += buckets[day]
+        if day - window >= 0:
+            total -= buckets[day - window]
+    return sums
+
+
+def calculate_open_series(items: list, start_date: datetime, days: int) -> dict:
+    no_activity_limit = timedelta(days=get_github_metrics('no_activity_limit'))
+    open_series = [0] * (days + 1)
+    unassigned_series = [0] * (days + 1)
+    outdated_series = [0] * (days + 1)
+    # The open items lifetime is (last update - creation). Before the last known update it
+    # is approximated by the item age, so it is split in a linear and a constant part.
+    aging_series = [0] * (days + 1)
+    aging_created_series = [0] * (days + 1)
+    lifetime_series = [0] * (days + 1)
+
+    for item in items:
+        created = get_day_index(start_date, item['created_at'])
+        updated = get_day_index(start_date, item['updated_at'])
+        if item['closed_at']:
+            closed = get_day_index(start_date, item['closed_at'])
+        else:
+            closed = days
+        add_interval(open_series, created, closed)
+        if item['assignee'] is None:
+            add_interval(unassigned_series, created, closed)
+        add_interval(outdated_series,
+                     get_day_index(start_date, item['created_at'] + no_activity_limit),
+                     min(updated, closed))
+        add_interval(outdated_series,
+                     get_day_index(start_date, item['updated_at'] + no_activity_limit), closed)
+
+        created_minutes = get_delta_time(start_date, item['created_at'], 'm')
+        add_interval(aging_series, created, min(updated, closed))
+        add_interval(aging_created_series, created, min(updated, closed), created_minutes)
+        lifetime = get_delta_time(item['created_at'], item['updated_at'], 'm')
+        add_interval(lifetime_series, updated, closed, lifetime)
+
+    open_counts = accumulate_series(open_series)
+    aging_counts = accumulate_series(aging_series)
+    aging_created = accumulate_series(aging_created_series)
+    lifetimes = accumulate_series(lifetime_series)
+    lifetime_average = []
+    for day in range(days):
+        day_minutes = day * DAY_SECONDS // 60
+        total = aging_counts[day] * day_minutes - aging_created[day] + lifetimes[day]
+        lifetime_average.append(total // open_counts[day] if open_counts[day] else 0)
+
+    return {'open': open_counts,
+            'unassigned_open': accumulate_series(unassigned_series),
+            'old_open': accumulate_series(outdated_series),
+            'open_lifetime': lifetime_average}
+
+
+def calculate_timeframe_series(
+        items: list, start_date: datetime, days: int, timeframe: int) -> dict:
+    created_buckets = [0] * days
+    closed_buckets = [0] * days
+    lifetime_buckets = [0] * days
+    for item in items:
+        created = get_day_index(start_date, item['created_at']) - 1
+        if 0 <= created < days:
+            created_buckets[created] += 1
+        if item['closed_at']:
+            closed = get_day_index(start_date, item['closed_at']) - 1
+            if 0 <= closed < days:
+                closed_buckets[closed] += 1
+                lifetime_buckets[closed] += get_delta_time(item['created_at'],
+                                                           item['closed_at'], 'm')
+
+    closed_counts = get_window_sums(closed_buckets, timeframe)
+    closed_lifetimes = get_window_sums(lifetime_buckets, timeframe)
+    lifetime_average = []
+    for day in range(days):
+        if closed_counts[day]:
+            lifetime_average.append(closed_lifetimes[day] // closed_counts[day])
+        else:
+            lifetime_average.append(0)
+    return {'created': get_window_sums(created_buckets, timeframe),
+            'closed': closed_counts,
+            'closed_lifetime': lifetime_average}
+
+
+def filter_team_items(items: list) -> list:
+    team_members = get_team_members()
+    return [item for item in items if is_team_member(item['reporter'], team_members)]
+
+
+def get_backfill_families(repo_id: str, items: list, type: str, start_date: datetime,
+                days: int):
+    # The metric ids and descriptions are the same created by process_open_items,
+    # collect_created_items and collect_item_lifetime_average in github_monitor.py.
+    repo_name = create_canonical_name(repo_id)
+    team_items = filter_team_items(items)
+    for suffix, metric_suffix, subset in [('', '', items), ('filed by team', '_team', team_items)]:
+        series = calculate_open_series(subset, start_date, days)
+        yield (f'{repo_name}_open_{type}{metric_suffix}',
+               f'Count of open {type} on {repo_id} {suffix}', series['open'])
+        yield (f'{repo_name}_unassigned_open_{type}{metric_suffix}',
+               f'Count of unassigned open {type} on {repo_id} {suffix}',
+               series['unassigned_open'])
+        yield (f'{repo_name}_old_open_{type}{metric_suffix}',
+               f'Count of old open {type} on {repo_id} {suffix}', series['old_open'])
+        state = 'open team' if metric_suffix else 'open'
+        yield (f'{repo_name}_open_{type}_lifetime_average{metric_suffix}',
+               f'Average lifetime of {state} {type} on {repo_id}',
+               series['open_lifetime'])
+
+    for timeframe in get_github_metrics('timeframe'):
+        series = calculate_timeframe_series(items, start_date, days, timeframe)
+        team_series = calculate_timeframe_series(team_items, start_date, days, timeframe)
+        suffix = f'from last {timeframe} days'
+        yield (f'{repo_name}_created_{type}_{timeframe}days',
+               f'Number of created {type} within last {timeframe} days on {repo_id}',
+               series['created'])
+        yield (f'{repo_name}_created_{type}_by_team_{timeframe}days',
+               f'Number of {type} created by team within last {timeframe} days on '
+               f'{repo_id}', team_series['created'])
+        yield (f'{repo_name}_closed_{type}_{timeframe}days',
+               f'Number of closed {type} on {repo_id} {suffix}', series['closed'])
+        yield (f'{repo_name}_closed_{type}_{timeframe}days_team',
+               f'Number of closed team {type} on {repo_id} {suffix}',
+               team_series['closed'])
+        yield (f'{repo_name}_closed_{type}_lifetime_average_{timeframe}days',
+               f'Average lifetime of closed {type} on {repo_id} {suffix}',
+               series['closed_lifetime'])
+        yield (f'{repo_name}_closed_{type}_lifetime_average_{timeframe}days_team',
+               f'Average lifetime of closed team {type} on {repo_id} {suffix}',
+               team_series['closed_lifetime'])
+
+
+def create_labels_string(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = [f'{name}="{value}"' for name, value in sorted(labels.items())]
+    return '{' + ','.join(pairs) + '}'
+
+
+def write_openmetrics_family(output, metric: str, description: str, values: list,
+                             start_date: datetime, first_day: int, labels_string: str) -> None:
+    start_timestamp = int(start_date.replace(tzinfo=timezone.utc).timestamp())
+    output.write(f'# HELP {metric} {description.strip()}\n')
+    output.write(f'# TYPE {metric} gauge\n')
+    for day in range(first_day, len(values)):
+        timestamp = start_timestamp + day * DAY_SECONDS
+        output.write(f'{metric}{labels_string} {values[day]} {timestamp}\n')
+
+
+def write_backfill_openmetrics(output, repo_id: str, items_files: dict, start_date: datetime,
+                               end_date: datetime, labels: dict) -> None:
+    labels_string = create_labels_string(labels)
+    for type, items_file in items_files.items():
+        items = read_items_file(items_file)
+        if not items:
+            continue
+        # The whole history is always calculated, so the timeframe windows are complete even
+        # in the first days after the informed start date.
+        first_date = min(item['created_at'] for item in items)
+        first_date = first_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        first_day = 0
+        if start_date:
+            first_day = max((start_date - first_date).days, 0)
+        days = (end_date - first_date).days + 1
+        if days <= first_day:
+            continue
+        # Families are written one by one, so the output is streamed instead of holding
+        # the whole history in memory.
+        for metric, description, values in get_backfill_families(repo_id, items, type,
+                                                                 first_date, days):
+            write_openmetrics_family(output, metric, description, values, first_date,
+                                     first_day, labels_string)
+    output.write('# EOF\n')
+
+
+def parse_arguments() -> ArgumentParser:
+    parser = ArgumentParser(description='Generate historical metrics in OpenMetrics format.')
+    parser.add_argument(
+        '-r', '--repository', action='store', required=True,
+        help='Repository name used in the metric ids, e.g.: ComplianceAsCode/content')
+    parser.add_argument(
+        '-i', '--issues', action='store', default='',
+        help='File with issues, as printed by the list-repo-issues action with "state=all".')
+    parser.add_argument(
+        '-p', '--pulls', action='store', default='',
+        help='File with pulls, as printed by the list-repo-pulls action.')
+    parser.add_argument(
+        '-s', '--start', action='store', default='',
+        help='First day to be generated, in YYYY-MM-DD format. Default: first created item.')
+    parser.add_argument(
+        '-e', '--end', action='store', default='',
+        help='Last day to be generated, in YYYY-MM-DD format. Default: yesterday.')
+    parser.add_argument(
+        '-l', '--labels', action='store', default='',
+        help='Comma separated labels included in all series, e.g.: exported_job=CommunityMon')
+    parser.add_argument(
+        '-o', '--output', action='store', default='',
+        help='Output file. Default: standard output.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    items_files = {}
+    if args.issues:
+        items_files['issues'] = args.issues
+    if args.pulls:
+        items_files['pulls'] = args.pulls
+    if not items_files:
+        print('Inform at least one issues or pulls file.')
+        sys.exit(1)
+
+    start_date = None
+    if args.start:
+        start_date = datetime.strptime(args.start, '%Y-%m-%d')
+    if args.end:
+        end_date = datetime.strptime(args.end, '%Y-%m-%d')
+    else:
+        end_date = datetime.utcnow().replace(hour=0, minute=0, second=0,
+                                             microsecond=0) - timedelta(days=1)
+    labels = create_dict_from_string(args.labels, ',')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            write_backfill_openmetrics(output, args.repository, items_files, start_date,
+                                       end_date, labels)
+    else:
+        write_backfill_openmetrics(sys.stdout, args.repository, items_files, start_date,
+                                   end_date, labels)
+
+
+if __name__ == '__main__':
+    main()
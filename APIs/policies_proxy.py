@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Script created to serve a local copy of the policies metrics to Prometheus.
+The upstream file is fetched with conditional requests, the last good copy is
+kept on disk and the proxy exposes its own freshness and latency metrics.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+# - https://github.com/prometheus/client_python
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST
+
+UPSTREAM_URL = ('https://complianceascode.github.io/content-pages/prometheus_stats/'
+                'policies_metrics')
+CACHE_FILE = 'policies_metrics'
+META_FILE = 'policies_metrics.json'
+
+cache = {'content': None, 'etag': None, 'last_modified': None, 'fetched_at': 0,
+         'changed_at': 0}
+cache_lock = threading.Lock()
+registry = CollectorRegistry()
+fetches_metric = Counter('policies_proxy_fetches', 'Count of upstream fetches by result',
+                         ['result'], registry=registry)
+duration_metric = Gauge('policies_proxy_fetch_duration_seconds',
+                        'Duration of the last upstream fetch', registry=registry)
+fetched_metric = Gauge('policies_proxy_last_success_timestamp_seconds',
+                       'Unix time of the last successful upstream fetch', registry=registry)
+changed_metric = Gauge('policies_proxy_last_change_timestamp_seconds',
+                       'Unix time when the upstream content last changed', registry=registry)
+age_metric = Gauge('policies_proxy_cache_age_seconds',
+                   'Seconds since the cached content was last validated', registry=registry)
+size_metric = Gauge('policies_proxy_cache_bytes', 'Size of the cached content',
+                    registry=registry)
+age_metric.set_function(lambda: time.time() - cache['fetched_at'] if cache['fetched_at']
+                        else -1)
+size_metric.set_function(lambda: len(cache['content']) if cache['content'] else 0)
+
+
+def load_cache(cache_dir: str) -> None:
+    cache_file = os.path.join(cache_dir, CACHE_FILE)
+    meta_file = os.path.join(cache_dir, META_FILE)
+    if not (os.path.exists(cache_file) and os.path.exists(meta_file)):
+        return
+    with open(meta_file, 'r') as json_file:
+        meta = json.load(json_file)
+    with open(cache_file, 'rb') as metrics_file:
+        content = metrics_file.read()
+    with cache_lock:
+        cache.update(meta)
+        cache['content'] = content
+    fetched_metric.set(cache['fetched_at'])
+    changed_metric.set(cache['changed_at'])
+
+
+def save_cache(cache_dir: str) -> None:
+    # Files are replaced atomically, so a failed write never corrupts the last good copy.
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, CACHE_FILE)
+    meta_file = os.path.join(cache_dir, META_FILE)
+    with open(f'{cache_file}.tmp', 'wb') as metrics_file:
+        metrics_file.write(cache['content'])
+    os.replace(f'{cache_file}.tmp', cache_file)
+    meta = {key: value for key, value in cache.items() if key != 'content'}
+    with open(f'{meta_file}.tmp', 'w') as json_file:
+        json.dump(meta, json_file)
+    os.replace(f'{meta_file}.tmp', meta_file)
+
+
+def create_conditional_request(url: str) -> urllib.request.Request:
+    headers = {}
+    if cache['content'] is not None:
+        if cache['etag']:
+            headers['If-None-Match'] = cache['etag']
+        if cache['last_modified']:
+            headers['If-Modified-Since'] = cache['last_modified']
+    return urllib.request.Request(url, headers=headers)
+
+
+def fetch_upstream(url: str, cache_dir: str, timeout: int) -> str:
+    start_time = time.time()
+    try:
+        with urllib.request.urlopen(create_conditional_request(url),
+                                    timeout=timeout) as response:
+            content = response.read()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+        result = 'modified'
+    except urllib.error.HTTPError as error:
+        if error.code != 304:
+            print(f'Failed to fetch {url}: {error}')
+            result = 'error'
+        else:
+            result = 'not_modified'
+    except (urllib.error.URLError, OSError) as error:
+        print(f'Failed to fetch {url}: {error}')
+        result = 'error'
+    now = time.time()
+    duration_metric.set(now - start_time)
+    fetches_metric.labels(result=result).inc()
+
+    if result == 'error':
+        return result
+    with cache_lock:
+        if result == 'modified':
+            if content != cache['content']:
+                cache['changed_at'] = now
+            cache.update({'content': content, 'etag': etag, 'last_modified': last_modified})
+        cache['fetched_at'] = now
+        save_cache(cache_dir)
+    fetched_metric.set(now)
+    changed_metric.set(cache['changed_at'])
+    return result
+
+
+def refresh_cache_loop(url: str, cache_dir: str, interval: int, timeout: int) -> None:
+    while True:
+        fetch_upstream(url, cache_dir, timeout)
+        time.sleep(interval)
+
+
+def create_request_handler(metrics_path: str) -> BaseHTTPRequestHandler:
+    class ProxyRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path == metrics_path:
+                content = cache['content']
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/metrics':
+                content = generate_latest(registry)
+                content_type = CONTENT_TYPE_LATEST
+            else:
+                self.send_error(404)
+                return
+            if content is None:
+                self.send_error(503, 'The upstream content was not fetched yet')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ProxyRequestHandler
+
+
+def parse_arguments() -> ArgumentParser:
+    parser = ArgumentParser(description='Serve a cached copy of the policies metrics.')
+    parser.add_argument(
+        '-u', '--url', action='store', default=UPSTREAM_URL,
+        help='Upstream URL of the policies metrics.')
+    parser.add_argument(
+        '-c', '--cache-dir', action='store', default='/var/cache/policies_proxy',
+        help='Folder where the last good copy is stored.')
+    parser.add_argument(
+        '-i', '--interval', action='store', type=int, default=900,
+        help='Seconds between the upstream validations.')
+    parser.add_argument(
+        '-t', '--timeout', action='store', type=int, default=60,
+        help='Timeout in seconds for the upstream requests.')
+    parser.add_argument(
+        '-p', '--port', action='store', type=int, default=9092,
+        help='Port used to serve the cached content and the proxy metrics.')
+    parser.add_argument(
+        '-m', '--metrics-path', action='store', default='/policies_metrics',
+        help='Path used to serve the cached content.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    load_cache(args.cache_dir)
+    refresh_thread = threading.Thread(
+        target=refresh_cache_loop, args=(args.url, args.cache_dir, args.interval, args.timeout),
+        daemon=True)
+    refresh_thread.start()
+    server = ThreadingHTTPServer(('', args.port), create_request_handler(args.metrics_path))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the profiling mode of the collection runs.
+The collectors, repositories and HTTP requests are recorded as spans in the
+Chrome trace-event format, together with a cProfile dump and a summary of the
+hot functions and the slowest endpoints. Spans cost nothing when the
+profiling is not enabled.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+# - https://docs.python.org/3/library/profile.html
+
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import urllib.parse
+
+profile = None
+SUMMARY_LIMIT = 15
+
+
+def start_profiling(profile_dir: str) -> None:
+    global profile
+    import requests
+
+    os.makedirs(profile_dir, exist_ok=True)
+    profile = {'dir': profile_dir, 'events': [], 'lock': threading.Lock(),
+               'start': time.perf_counter(), 'profiler': cProfile.Profile()}
+    # PyGithub sends all its requests through requests.Session.
+    profile['send'] = requests.Session.send
+    requests.Session.send = trace_session_send(requests.Session.send)
+    profile['profiler'].enable()
+
+
+def stop_profiling() -> None:
+    global profile
+    import requests
+
+    if profile is None:
+        return
+    profile['profiler'].disable()
+    requests.Session.send = profile['send']
+    pstats_file = os.path.join(profile['dir'], 'collection.pstats')
+    profile['profiler'].dump_stats(pstats_file)
+    with open(os.path.join(profile['dir'], 'trace.json'), 'w') as json_file:
+        json.dump({'traceEvents': profile['events'], 'displayTimeUnit': 'ms'}, json_file)
+    summary = create_summary(pstats_file, profile['events'])
+    with open(os.path.join(profile['dir'], 'summary.txt'), 'w') as summary_file:
+        summary_file.write(summary)
+    print(summary)
+    profile = None
+
+
+def get_timestamp_us(counter: float) -> float:
+    return (counter - profile['start']) * 1000000
+
+
+def append_trace_event(name: str, category: str, start: float, end: float, args: dict) -> None:
+    event = {'name': name, 'cat': category, 'ph': 'X', 'ts': get_timestamp_us(start),
+             'dur': (end - start) * 1000000, 'pid': os.getpid(),
+             'tid': threading.get_ident(), 'args': args}
+    with profile['lock']:
+        profile['events'].append(event)
+
+
+@contextmanager
+def span(name: str, category: str, **args):
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        append_trace_event(name, category, start, time.perf_counter(), args)
+
+
+def get_url_template(url: str) -> str:
+    # Owners, repositories, orgs, teams, users and numbers are replaced, so the requests of the
+    # same endpoint are grouped in the summary.
+    segments = urllib.parse.urlparse(url).path.strip('/').split('/')
+    if segments[0] == 'repos' and len(segments) >= 3:
+        segments[1:3] = ['{owner}', '{repo}']
+    elif segments[0] in ['orgs', 'users'] and len(segments) >= 2:
+        segments[1] = '{org}' if segments[0] == 'orgs' else '{user}'
+        if len(segments) >= 4 and segments[2] == 'teams':
+            segments[3] = '{team}'
+    segments = ['{number}' if segment.isdigit() else segment for segment in segments]
+    return '/' + '/'.join(segments)
+
+
+def get_url_page(url: str) -> int:
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    return int(query.get('page', ['1'])[0])
+
+
+def record_http_span(method: str, url: str, status: int, size: int, start: float) -> None:
+    if profile is None:
+        return
+    template = get_url_template(url)
+    append_trace_event(f'{method} {template}', 'http', start, time.perf_counter(),
+                       {'url': url, 'template': template, 'page': get_url_page(url),
+                        'status': status, 'bytes': size})
+
+
+def trace_session_send(send):
+    def traced_send(session, request, **kwargs):
+        start = time.perf_counter()
+        response = send(session, request, **kwargs)
+        record_http_span(request.method, request.url, response.status_code,
+                         len(response.content), start)
+        return response
+    return traced_send
+
+
+def get_endpoints_summary(events: list) -> list:
+    endpoints = {}
+    for event in events:
+        if event['cat'] != 'http':
+            continue
+        endpoint = endpoints.setdefault(event['name'], {'count': 0, 'total': 0, 'max': 0,
+                                                        'bytes': 0})
+        endpoint['count'] += 1
+        endpoint['total'] += event['dur'] / 1000000
+        endpoint['max'] = max(endpoint['max'], event['dur'] / 1000000)
+        endpoint['bytes'] += event['args']['bytes']
+    return sorted(endpoints.items(), key=lambda item: item[1]['total'], reverse=True)
+
+
+def create_summary(pstats_file: str, events: list) -> str:
+    output = io.StringIO()
+    output.write(f'Top {SUMMARY_LIMIT} hot functions by own time:\n')
+    stats = pstats.Stats(pstats_file, stream=output)
+    stats.strip_dirs().sort_stats('tottime').print_stats(SUMMARY_LIMIT)
+    output.write(f'Top {SUMMARY_LIMIT} slowest endpoints by total time:\n')
+    output.write('endpoint,requests,totalSeconds,maxSeconds,bytes\n')
+    for name, endpoint in get_endpoints_summary(events)[:SUMMARY_LIMIT]:
+        output.write(f"{name},{endpoint['count']},{endpoint['total']:.3f},"
+                     f"{endpoint['max']:.3f},{endpoint['bytes']}\n")
+    return output.getvalue()
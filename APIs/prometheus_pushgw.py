@@ -8,14 +8,29 @@ the Pushgateway.
 Author: Marcus Burghardt - https://github.com/marcusburghardt
 """
 
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+import json
+import os
+import sys
+import time
+import urllib.request
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+from prometheus_client import pushadd_to_gateway, push_to_gateway
 from common import (
     CONF_FILE,
     create_dict_from_list,
     get_delta_time,
     get_github_metrics,
-    get_parameter_value
+    get_optional_parameter_value,
+    get_parameter_value,
+    get_state_file
     )
+from exposition import is_exposition_changed
+from prometheus_remote_write import push_remote_write_metrics
+
+
+# Time, in milliseconds, when each metric was created. The metrics are created right after their
+# repository or collector finishes, so it is the collection time sent by the remote-write output.
+metric_timestamps = {}
 
 
 def create_pushgateway_registry():
@@ -25,12 +40,24 @@ def create_pushgateway_registry():
 def create_pushgateway_gauge_metric(unit, description, value, registry):
     metric = Gauge(unit, description, registry=registry)
     metric.set(value)
+    metric_timestamps[unit] = int(time.time() * 1000)
     return registry
 
 
 def create_workflows_runs_metric(
         unit: str, description: str, registry: CollectorRegistry) -> Gauge:
     metric = Gauge(unit, description, ['status'], registry=registry)
+    metric_timestamps[unit] = int(time.time() * 1000)
+    return metric
+
+
+def create_labeled_gauge_metric(
+        unit: str, description: str, labels: list, registry: CollectorRegistry) -> Gauge:
+    return Gauge(unit, description, labels, registry=registry)
+
+
+def append_labeled_gauge_metric(metric: Gauge, labels: dict, value: float) -> Gauge:
+    metric.labels(**labels).set(value)
     return metric
 
 
@@ -69,7 +96,99 @@ def append_pushgateway_metrics(
     return metrics
 
 
-def push_pushgateway_metrics(registry):
+def append_shard_status_metrics(
+        registry: CollectorRegistry, repositories: int, duration: int) -> CollectorRegistry:
+    registry = create_pushgateway_gauge_metric(
+        'communitymon_shard_repositories', 'Count of repositories collected by the shard',
+        repositories, registry)
+    registry = create_pushgateway_gauge_metric(
+        'communitymon_shard_duration_seconds', 'Duration of the last shard collection',
+        duration, registry)
+    registry = create_pushgateway_gauge_metric(
+        'communitymon_shard_completed_timestamp_seconds',
+        'Unix time when the last shard collection was completed', time.time(), registry)
+    return registry
+
+
+def get_pushgateway_groups() -> list:
+    target = get_parameter_value(CONF_FILE, 'prometheus', 'push_target')
+    if not target.startswith(('http://', 'https://')):
+        target = f'http://{target}'
+    with urllib.request.urlopen(f'{target}/api/v1/metrics') as response:
+        return json.load(response)['data']
+
+
+def get_pushgateway_metric_value(group: dict, metric: str) -> float:
+    if metric not in group:
+        return None
+    return float(group[metric]['metrics'][0]['value'])
+
+
+def get_shards_status() -> list:
+    job_name = get_parameter_value(CONF_FILE, 'prometheus', 'push_job')
+    shards_status = []
+    for group in get_pushgateway_groups():
+        labels = group['labels']
+        # The token metrics of the shards are pushed in other groups with the shard labels.
+        if labels.get('job') != job_name or 'communitymon_shard_repositories' not in group:
+            continue
+        shards_status.append({
+            'shard': int(labels['shard']),
+            'shards': int(labels['shards']),
+            'repositories': get_pushgateway_metric_value(
+                group, 'communitymon_shard_repositories'),
+            'duration_seconds': get_pushgateway_metric_value(
+                group, 'communitymon_shard_duration_seconds'),
+            'completed_at': get_pushgateway_metric_value(
+                group, 'communitymon_shard_completed_timestamp_seconds')})
+    return sorted(shards_status, key=lambda status: (status['shards'], status['shard']))
+
+
+def is_push_unchanged(pending_file: str, pushed_file: str) -> bool:
+    # The push is only skipped within the informed minutes, so the Pushgateway is refreshed
+    # from time to time even without changes, e.g. after a restart.
+    max_age = get_optional_parameter_value(CONF_FILE, 'prometheus', 'skip_unchanged_push')
+    if not max_age or not os.path.exists(pushed_file):
+        return False
+    if time.time() - os.path.getmtime(pushed_file) > max_age * 60:
+        return False
+    return not is_exposition_changed(pushed_file, pending_file)
+
+
+def save_push_snapshot(registry: CollectorRegistry, snapshot_file: str) -> None:
+    with open(snapshot_file, 'wb') as metrics_file:
+        metrics_file.write(generate_latest(registry))
+
+
+def push_pushgateway_metrics(registry, grouping_key=None, replace=True):
     target = get_parameter_value(CONF_FILE, 'prometheus', 'push_target')
     job_name = get_parameter_value(CONF_FILE, 'prometheus', 'push_job')
-    push_to_gateway(target, job=job_name, registry=registry)
+    # Shards always change their status metrics, so only the single collection is compared.
+    compare = grouping_key is None and replace
+    if compare:
+        pending_file = get_state_file('pending_push.prom')
+        pushed_file = get_state_file('last_push.prom')
+        save_push_snapshot(registry, pending_file)
+        if is_push_unchanged(pending_file, pushed_file):
+            print('Metrics not changed since the last push.')
+            return
+    if replace:
+        push_to_gateway(target, job=job_name, registry=registry, grouping_key=grouping_key)
+    else:
+        # Partial collections only replace the pushed metrics. The previous values of the
+        # metrics not collected are kept in the group.
+        pushadd_to_gateway(target, job=job_name, registry=registry, grouping_key=grouping_key)
+    if compare:
+        os.replace(pending_file, pushed_file)
+
+
+def push_prometheus_metrics(registry, grouping_key=None, replace=True):
+    output = get_optional_parameter_value(CONF_FILE, 'prometheus', 'output', 'pushgateway')
+    if output == 'remote_write':
+        # Each sample is stored with its own timestamp, so partial pushes need no special care.
+        push_remote_write_metrics(registry, grouping_key, metric_timestamps)
+    elif output == 'pushgateway':
+        push_pushgateway_metrics(registry, grouping_key, replace)
+    else:
+        print(f'Output {output} is not available.')
+        sys.exit(1)
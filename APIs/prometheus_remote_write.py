@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+This file is used to accommodate the Prometheus remote-write output. The
+metrics are sent straight to Prometheus, with the collection time of each
+metric as sample timestamp, instead of being scraped from the Pushgateway. The script can also
+run a local stand-in receiver which prints the received samples.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://prometheus.io/docs/concepts/remote_write_spec/
+# - https://github.com/prometheus/prometheus/blob/main/prompb/types.proto
+# - https://protobuf.dev/programming-guides/encoding/
+
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import struct
+import sys
+import time
+import urllib.error
+import urllib.request
+from prometheus_client import CollectorRegistry
+
+from common import CONF_FILE, get_optional_parameter_value, get_parameter_value
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+DEFAULT_REMOTE_WRITE_URL = 'http://localhost:9090/api/v1/write'
+DEFAULT_BATCH_SIZE = 500
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1
+
+
+def encode_varint(value: int) -> bytes:
+    # Negative int64 values are encoded as their two's complement, like protobuf does.
+    value &= 0xFFFFFFFFFFFFFFFF
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_length_delimited(field: int, data: bytes) -> bytes:
+    return encode_varint(field << 3 | 2) + encode_varint(len(data)) + data
+
+
+def encode_label(name: str, value: str) -> bytes:
+    return (encode_length_delimited(1, name.encode('utf-8')) +
+            encode_length_delimited(2, value.encode('utf-8')))
+
+
+def encode_sample(value: float, timestamp: int) -> bytes:
+    # The value is a double (fixed 64 bits) and the timestamp an int64 in milliseconds.
+    return encode_varint(1 << 3 | 1) + struct.pack('<d', value) + \
+        encode_varint(2 << 3) + encode_varint(timestamp)
+
+
+def encode_timeseries(labels: dict, value: float, timestamp: int) -> bytes:
+    # The labels must be sorted by name.
+    data = b''.join(encode_length_delimited(1, encode_label(name, labels[name]))
+                    for name in sorted(labels))
+    return data + encode_length_delimited(2, encode_sample(value, timestamp))
+
+
+def encode_write_request(series: list) -> bytes:
+    return b''.join(encode_length_delimited(1, encode_timeseries(*item)) for item in series)
+
+
+def decode_varint(data: bytes, position: int) -> tuple:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def decode_fields(data: bytes):
+    position = 0
+    while position < len(data):
+        key, position = decode_varint(data, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = decode_varint(data, position)
+        elif wire_type == 1:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == 2:
+            length, position = decode_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        else:
+            raise ValueError(f'Unsupported wire type {wire_type}')
+        yield field, value
+
+
+def decode_write_request(data: bytes) -> list:
+    series = []
+    for field, timeseries in decode_fields(data):
+        labels = {}
+        samples = []
+        for timeseries_field, value in decode_fields(timeseries):
+            if timeseries_field == 1:
+                label = dict(decode_fields(value))
+                labels[label[1].decode('utf-8')] = label.get(2, b'').decode('utf-8')
+            elif timeseries_field == 2:
+                sample = dict(decode_fields(value))
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((struct.unpack('<d', sample[1])[0], timestamp))
+        series.append((labels, samples))
+    return series
+
+
+def get_registry_series(registry: CollectorRegistry, labels: dict, timestamps: dict,
+                        push_timestamp: int) -> list:
+    # The metrics without a collection time, like the shard status, use the push time.
+    series = []
+    for metric in registry.collect():
+        timestamp = timestamps.get(metric.name, push_timestamp)
+        for sample in metric.samples:
+            sample_labels = dict(labels, **sample.labels)
+            sample_labels['__name__'] = sample.name
+            series.append((sample_labels, float(sample.value), timestamp))
+    return series
+
+
+def send_write_request(url: str, series: list) -> None:
+    data = snappy.compress(encode_write_request(series))
+    headers = {'Content-Encoding': 'snappy', 'Content-Type': 'application/x-protobuf',
+               'User-Agent': 'CommunityMon', 'X-Prometheus-Remote-Write-Version': '0.1.0'}
+    for attempt in range(MAX_RETRIES + 1):
+        request = urllib.request.Request(url, data=data, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT):
+                return
+        except urllib.error.HTTPError as error:
+            # Only server errors and throttling are retried. The other errors would fail again.
+            if error.code < 500 and error.code != 429:
+                raise
+            failure = error
+        except (urllib.error.URLError, OSError) as error:
+            failure = error
+        if attempt < MAX_RETRIES:
+            wait = RETRY_BACKOFF * 2 ** attempt
+            print(f'Remote write failed: {failure}. Retrying in {wait} seconds.')
+            time.sleep(wait)
+    raise failure
+
+
+def push_remote_write_metrics(registry: CollectorRegistry, grouping_key=None,
+                              timestamps=None) -> None:
+    if snappy is None:
+        print('The python-snappy module is required by the remote_write output.')
+        sys.exit(1)
+    url = get_optional_parameter_value(CONF_FILE, 'prometheus', 'remote_write_url',
+                                       DEFAULT_REMOTE_WRITE_URL)
+    batch_size = get_optional_parameter_value(CONF_FILE, 'prometheus', 'remote_write_batch',
+                                              DEFAULT_BATCH_SIZE)
+    # The same labels of the Pushgateway groups, plus the optional static labels.
+    labels = {'job': get_parameter_value(CONF_FILE, 'prometheus', 'push_job')}
+    labels.update(get_optional_parameter_value(CONF_FILE, 'prometheus', 'remote_write_labels',
+                                               {}) or {})
+    labels.update(grouping_key or {})
+    series = get_registry_series(registry, labels, timestamps or {}, int(time.time() * 1000))
+    for start in range(0, len(series), batch_size):
+        send_write_request(url, series[start:start + batch_size])
+
+
+def create_receiver_handler() -> BaseHTTPRequestHandler:
+    class ReceiverRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Encoding') == 'snappy':
+                data = snappy.decompress(data)
+            series = decode_write_request(data)
+            for labels, samples in series:
+                name = labels.pop('__name__', '')
+                labels_string = ','.join(f'{label}="{labels[label]}"' for label in sorted(labels))
+                for value, timestamp in samples:
+                    print(f'{name}{{{labels_string}}} {value} {timestamp}')
+            print(f'# Received {len(series)} series')
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReceiverRequestHandler
+
+
+def parse_arguments() -> ArgumentParser:
+    parser = ArgumentParser(description='Local stand-in receiver for remote-write requests.')
+    parser.add_argument(
+        '-p', '--port', action='store', type=int, default=9095,
+        help='Port used to receive the remote-write requests.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if snappy is None:
+        print('The python-snappy module is required by the receiver.')
+        sys.exit(1)
+    server = HTTPServer(('', args.port), create_receiver_handler())
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Script created to generate Prometheus recording rules for the metrics sent by
+CommunityMon and to rewrite the Grafana dashboards queries to use them.
+
+Author: Marcus Burghardt - https://github.com/marcusburghardt
+"""
+
+# References:
+# - https://prometheus.io/docs/prometheus/latest/configuration/recording_rules/
+# - https://prometheus.io/docs/practices/rules/
+
+from argparse import ArgumentParser
+import json
+import os
+import re
+import urllib.request
+import yaml
+
+from common import (
+    create_canonical_name,
+    create_list_from_string,
+    get_github_labels,
+    get_github_metrics,
+    root_path,
+    )
+
+RULES_FILE = f'{root_path}/../Stack/prometheus/conf/rules/communitymon.yml'
+DASHBOARDS_PATH = f'{root_path}/../Stack/gfn_env/dashboards'
+POLICIES_FILE = f'{root_path}/../Sample_Files/policies_metrics'
+POLICY_STATUS_PREFIX = 'policy_requirements_status_'
+POLICY_PERCENTS = {'assessed': 'assessed', 'full coverage': 'full_coverage'}
+RULES_INTERVAL = '5m'
+# Pushgateway metrics are scraped every 15 minutes, which is longer than the default lookback,
+# so the rules use the last value within a scrape interval.
+LOOKBACK = '15m'
+
+
+def get_open_items_suffixes(type: str) -> list:
+    suffixes = []
+    for team_suffix in ['', '_team']:
+        for prefix in ['', 'unassigned_', 'old_']:
+            suffixes.append(f'{prefix}open_{type}{team_suffix}')
+    return suffixes
+
+
+def get_labels_suffixes() -> list:
+    suffixes = []
+    for label in get_github_labels() or []:
+        canonical_label = create_canonical_name(label).lower()
+        for type in ['issues', 'pulls']:
+            for suffix in ['', '_unassigned', '_old']:
+                suffixes.append(f'open_{type}_label_{canonical_label}{suffix}')
+    return suffixes
+
+
+def get_lifetime_suffixes(type: str) -> list:
+    suffixes = []
+    for timeframe in get_github_metrics('timeframe'):
+        for team_suffix in ['', '_team']:
+            suffixes.append(f'closed_{type}_{timeframe}days{team_suffix}')
+            suffixes.append(f'closed_{type}_lifetime_average_{timeframe}days{team_suffix}')
+    suffixes.append(f'open_{type}_lifetime_average')
+    suffixes.append(f'open_{type}_lifetime_average_team')
+    return suffixes
+
+
+def get_repository_metric_suffixes() -> list:
+    # Mirrors the metric ids created by collect_repository_metrics_prometheus in
+    # github_monitor.py for each repository metric enabled in apis.yml.
+    suffixes = []
+    for metric in get_github_metrics('repo'):
+        if metric in ['contributors', 'events']:
+            suffixes.append(metric)
+        elif metric == 'general_info':
+            suffixes.extend(['forks_count', 'stargazers_count', 'subscribers_count', 'archived',
+                             'private', 'open_issues_count', 'labels_count'])
+        elif metric == 'issues_by_label':
+            suffixes.extend(get_labels_suffixes())
+        elif metric in ['open_issues', 'open_pulls']:
+            suffixes.extend(get_open_items_suffixes(metric.split('_')[1]))
+        elif metric in ['created_issues_by_timeframe', 'created_pulls_by_timeframe']:
+            type = metric.split('_')[1]
+            for timeframe in get_github_metrics('timeframe'):
+                suffixes.append(f'created_{type}_{timeframe}days')
+                suffixes.append(f'created_{type}_by_team_{timeframe}days')
+        elif metric in ['issues_lifetime_average', 'pulls_lifetime_average']:
+            suffixes.extend(get_lifetime_suffixes(metric.split('_')[0]))
+    return suffixes
+
+
+def get_policy_status_families(policies_file: str) -> list:
+    if policies_file.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(policies_file) as response:
+            lines = response.read().decode('utf-8').splitlines()
+    else:
+        with open(policies_file, 'r') as metrics_file:
+            lines = metrics_file.read().splitlines()
+    families = []
+    for line in lines:
+        if line.startswith('# TYPE '):
+            family = line.split()[2]
+            if family.startswith(POLICY_STATUS_PREFIX):
+                families.append(family)
+    return families
+
+
+def create_recording_rule(record: str, expr: str, labels=None) -> dict:
+    rule = {'record': record, 'expr': expr}
+    if labels:
+        rule['labels'] = labels
+    return rule
+
+
+def create_repository_rules(org_id: str, repositories: list, suffixes: list) -> list:
+    rules = []
+    for repo_id in repositories:
+        repo_name = create_canonical_name(repo_id)
+        for suffix in suffixes:
+            metric = f'{repo_name}_{suffix}'
+            rules.append(create_recording_rule(
+                f'job:{metric}:sum', f'sum(last_over_time({metric}[{LOOKBACK}]))'))
+
+    org_name = create_canonical_name(org_id)
+    for suffix in suffixes:
+        metrics = '|'.join(f'{create_canonical_name(repo_id)}_{suffix}'
+                           for repo_id in repositories)
+        rules.append(create_recording_rule(
+            f'org:{suffix}:sum', f'sum(last_over_time({{__name__=~"{metrics}"}}[{LOOKBACK}]))',
+            {'org': org_name}))
+
+    for type in ['issues', 'pulls']:
+        for ratio, base in [(f'unassigned_open_{type}', f'open_{type}'),
+                            (f'old_open_{type}', f'open_{type}'),
+                            (f'open_{type}_team', f'open_{type}')]:
+            if ratio in suffixes and base in suffixes:
+                rules.append(create_recording_rule(
+                    f'org:{ratio}:ratio',
+                    f'org:{ratio}:sum{{org="{org_name}"}} / org:{base}:sum{{org="{org_name}"}}',
+                    {'org': org_name}))
+    return rules
+
+
+def create_policies_rules(families: list) -> list:
+    rules = []
+    for family in families:
+        policy = family[len(POLICY_STATUS_PREFIX):]
+        for status, name in POLICY_PERCENTS.items():
+            record = f'level:{family}:{name}_percent'
+            rules.append(create_recording_rule(
+                record,
+                f'sum by (level) (last_over_time({family}{{status="{status}"}}[{LOOKBACK}])) / '
+                f'sum by (level) (last_over_time({family}{{status="all"}}[{LOOKBACK}])) * 100'))
+            # Single family with all policies, so org-wide coverage doesn't need one query
+            # per policy.
+            rules.append(create_recording_rule(
+                f'policy_level:requirements_{name}:percent', record, {'policy': policy}))
+    return rules
+
+
+def create_rules_groups(org_id: str, repositories: list, policies_file: str) -> dict:
+    groups = []
+    if repositories:
+        rules = create_repository_rules(org_id, repositories, get_repository_metric_suffixes())
+        groups.append({'name': 'communitymon_repositories', 'interval': RULES_INTERVAL,
+                       'rules': rules})
+    if policies_file:
+        rules = create_policies_rules(get_policy_status_families(policies_file))
+        groups.append({'name': 'communitymon_policies', 'interval': RULES_INTERVAL,
+                       'rules': rules})
+    return {'groups': groups}
+
+
+def write_rules_file(rules_groups: dict, rules_file: str) -> None:
+    os.makedirs(os.path.dirname(rules_file), exist_ok=True)
+    with open(rules_file, 'w') as yml_file:
+        yaml.safe_dump(rules_groups, yml_file, sort_keys=False, width=1000)
+
+
+def get_recorded_expressions(rules_groups: dict) -> tuple:
+    recorded_metrics = set()
+    recorded_families = set()
+    for group in rules_groups['groups']:
+        for rule in group['rules']:
+            record = rule['record']
+            if record.startswith('job:'):
+                recorded_metrics.add(record.split(':')[1])
+            elif record.startswith('level:'):
+                recorded_families.add(record.split(':')[1])
+    return recorded_metrics, recorded_families
+
+
+def rewrite_expression(expr: str, recorded_metrics: set, recorded_families: set) -> str:
+    def replace_sum(match):
+        if match.group(1) in recorded_metrics:
+            return f'job:{match.group(1)}:sum'
+        return match.group(0)
+
+    def replace_percent(match):
+        family, level, status = match.group(1), match.group(2), match.group(3)
+        if family in recorded_families and status in POLICY_PERCENTS:
+            return f'level:{family}:{POLICY_PERCENTS[status]}_percent{{level="{level}"}}'
+        return match.group(0)
+
+    expr = re.sub(r'sum\((\w+)\{exported_job=~"\.\*"\}\)', replace_sum, expr)
+    expr = re.sub(r'sum by \(level\) \((\w+)\{level="([^"]+)", status="([^"]+)"\}\) / '
+                  r'sum by \(level\) \(\1\{level="\2", status="all"\}\) \* 100',
+                  replace_percent, expr)
+    return expr
+
+
+def get_dashboard_expressions(dashboard: object) -> list:
+    expressions = []
+    if isinstance(dashboard, dict):
+        for key, value in dashboard.items():
+            if key == 'expr' and isinstance(value, str):
+                expressions.append(value)
+            else:
+                expressions.extend(get_dashboard_expressions(value))
+    elif isinstance(dashboard, list):
+        for item in dashboard:
+            expressions.extend(get_dashboard_expressions(item))
+    return expressions
+
+
+def rewrite_dashboard(dashboard_file: str, recorded_metrics: set,
+                      recorded_families: set) -> int:
+    with open(dashboard_file, 'r') as json_file:
+        content = json_file.read()
+    rewritten = 0
+    for expr in set(get_dashboard_expressions(json.loads(content))):
+        new_expr = rewrite_expression(expr, recorded_metrics, recorded_families)
+        if new_expr != expr:
+            # The raw content is replaced to preserve the dashboard formatting.
+            old_string = json.dumps(expr)
+            rewritten += content.count(old_string)
+            content = content.replace(old_string, json.dumps(new_expr))
+    with open(dashboard_file, 'w') as json_file:
+        json_file.write(content)
+    return rewritten
+
+
+def parse_arguments() -> ArgumentParser:
+    parser = ArgumentParser(description='Generate recording rules for CommunityMon metrics.')
+    parser.add_argument(
+        '-o', '--org', action='store', default='ExampleOrg',
+        help='The organization ID used for the rollups.')
+    parser.add_argument(
+        '-r', '--repositories', action='store', default='',
+        help='Comma separated repositories included in the rules.')
+    parser.add_argument(
+        '-p', '--policies', action='store', default=POLICIES_FILE,
+        help='File or URL with the policies metrics. Use "" to skip the policies rules.')
+    parser.add_argument(
+        '-w', '--rules-file', action='store', default=RULES_FILE,
+        help='Rules file to be written.')
+    parser.add_argument(
+        '-d', '--dashboards', action='store', default='',
+        help=f'Rewrite the dashboards queries in this folder, e.g.: {DASHBOARDS_PATH}')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    repositories = []
+    if args.repositories:
+        repositories = create_list_from_string(args.repositories, ',')
+
+    rules_groups = create_rules_groups(args.org, repositories, args.policies)
+    write_rules_file(rules_groups, args.rules_file)
+    print(f'Rules written to {args.rules_file}')
+
+    if args.dashboards:
+        recorded_metrics, recorded_families = get_recorded_expressions(rules_groups)
+        for dashboard in sorted(os.listdir(args.dashboards)):
+            if not dashboard.endswith('.json'):
+                continue
+            rewritten = rewrite_dashboard(os.path.join(args.dashboards, dashboard),
+                                          recorded_metrics, recorded_families)
+            print(f'{dashboard}: {rewritten} queries rewritten')
+
+
+if __name__ == '__main__':
+    main()